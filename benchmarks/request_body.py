@@ -0,0 +1,79 @@
+"""
+Per-request overhead of getting the request body in process_response.
+
+Before, the body was parsed again from the encoded bytes,
+now the body kept in the request arguments by get_request_kwargs is taken.
+
+    python -m benchmarks.request_body
+"""
+import timeit
+
+import requests
+from requests import Response
+
+from tapi_yandex_direct.tapi_yandex_direct import (
+    RequestKwargs,
+    YandexDirectClientAdapter,
+)
+
+NUMBER = 20
+
+
+def create_body(count: int) -> dict:
+    return {
+        "method": "set",
+        "params": {
+            "KeywordBids": [
+                {"KeywordId": 10000000 + i, "SearchBid": 3000000, "NetworkBid": 1000000}
+                for i in range(count)
+            ]
+        },
+    }
+
+
+def create_response() -> Response:
+    response = Response()
+    response.status_code = 200
+    response._content = b'{"result": {"SetResults": []}}'
+    response.request = requests.Request(
+        "POST", "https://api.direct.yandex.com/json/v5/keywordbids"
+    ).prepare()
+    return response
+
+
+def main():
+    adapter = YandexDirectClientAdapter()
+    response = create_response()
+
+    for count in (1000, 10000, 50000):
+        body = create_body(count)
+        encoded = adapter.format_data_to_request(body)
+
+        def before():
+            # Bytes not encoded by the adapter are parsed again.
+            adapter.process_response(
+                response, {"data": bytes(encoded)}, api_params={}, store={}
+            )
+
+        def after():
+            request_kwargs = RequestKwargs(data=encoded)
+            request_kwargs.body = body
+            adapter.process_response(
+                response, request_kwargs, api_params={}, store={}
+            )
+
+        before_time = timeit.timeit(before, number=NUMBER) / NUMBER
+        after_time = timeit.timeit(after, number=NUMBER) / NUMBER
+
+        print(
+            "{} objects, {:.1f} MB: before {:.2f} ms, after {:.2f} ms".format(
+                count,
+                len(encoded) / 1024 ** 2,
+                before_time * 1000,
+                after_time * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
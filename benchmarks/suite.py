@@ -0,0 +1,238 @@
+"""
+Offline benchmarks of the hot paths of the client.
+
+The responses of the API are synthetic fixtures served by the adapter of the session,
+so the full path of the client is measured without network.
+The results are saved to benchmarks/results/<version>.json
+and compared with the results of another version.
+Existing results are not overwritten without --force.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --rows 10000000 --save results.json \\
+        --compare benchmarks/results/2021.5.29.json
+"""
+
+import argparse
+import collections
+import datetime as dt
+import json
+import logging
+import platform
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, Dict
+
+import orjson
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+
+import tapi_yandex_direct
+from tapi_yandex_direct import YandexDirect
+from tapi_yandex_direct.cache import build_response
+from tapi_yandex_direct.tapi_yandex_direct import YandexDirectClientAdapter
+
+RESULTS_PATH = Path(__file__).parent / "results"
+REPORT_COLUMNS = ["Date", "CampaignId", "CampaignName", "Impressions", "Clicks", "Cost"]
+PAGE_SIZE = 1000
+PAGES = 100
+# Slowdown relative to the compared results that is considered a regression.
+REGRESSION_RATIO = 1.1
+
+
+def create_report(rows: int) -> bytes:
+    lines = ["\t".join(REPORT_COLUMNS)]
+    for i in range(rows):
+        lines.append(
+            "2021-05-{:02d}\t{}\tCampaign {}\t{}\t{}\t{}".format(
+                i % 28 + 1, 1000 + i % 500, i % 500, i % 10000, i % 100, i * 10000
+            )
+        )
+    return "\n".join(lines).encode() + b"\n"
+
+
+def create_page(offset: int) -> bytes:
+    result = {
+        "Campaigns": [
+            {"Id": offset + i, "Name": "Campaign {}".format(offset + i)}
+            for i in range(PAGE_SIZE)
+        ]
+    }
+    if offset + PAGE_SIZE < PAGE_SIZE * PAGES:
+        result["LimitedBy"] = offset + PAGE_SIZE
+    return orjson.dumps({"result": result})
+
+
+class FixtureAdapter(HTTPAdapter):
+    """Serves the fixtures instead of the API."""
+
+    def __init__(self, report: bytes, **kwargs):
+        self.report = report
+        self.pages = {}
+        super().__init__(**kwargs)
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        response = build_response(request, {}, self)
+        if request.path_url.endswith("/reports"):
+            response._content = self.report
+        else:
+            body = orjson.loads(request.body)
+            offset = body["params"].get("Page", {}).get("Offset", 0)
+            if offset not in self.pages:
+                self.pages[offset] = create_page(offset)
+            response._content = self.pages[offset]
+        response._content_consumed = True
+        return response
+
+
+def measure(func: Callable, repeat: int) -> float:
+    """Minimum time of one call in seconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def consume(iterator) -> None:
+    collections.deque(iterator, maxlen=0)
+
+
+def run(rows: int, repeat: int) -> Dict[str, float]:
+    client = YandexDirect(access_token="")
+    client._session.mount("https://", FixtureAdapter(create_report(rows)))
+    report = client.reports().post(data={"params": {}})
+    stream_client = YandexDirect(access_token="", stream_report=True)
+    stream_client._session.mount("https://", client._session.get_adapter("https://"))
+    tsv_path = Path(tempfile.mkdtemp()) / "report.tsv"
+
+    adapter = YandexDirectClientAdapter()
+    set_body = {
+        "method": "set",
+        "params": {
+            "KeywordBids": [
+                {"KeywordId": 10000000 + i, "SearchBid": 3000000} for i in range(10000)
+            ]
+        },
+    }
+
+    error_response = build_response(report.response.request, {}, None)
+    error_message = {"error": {"error_code": 1000}}
+
+    def retry_dispatch():
+        for repeat_number in range(1, 1001):
+            adapter._get_retry_sleep(
+                None,
+                error_message,
+                repeat_number,
+                error_response,
+                {},
+                {"retries_if_server_error": 10**6},
+                store={},
+            )
+
+    benchmarks = {
+        "report_post": lambda: client.reports().post(data={"params": {}}),
+        "report_iter_lines": lambda: consume(report().iter_lines()),
+        "report_iter_values": lambda: consume(report().iter_values()),
+        "report_iter_values_2_columns": lambda: consume(
+            report().iter_values(columns=["CampaignId", "Cost"])
+        ),
+        # The lines are split only up to the selected columns.
+        "report_iter_values_2_first_columns": lambda: consume(
+            report().iter_values(columns=["Date", "CampaignId"])
+        ),
+        "report_iter_dicts": lambda: consume(report().iter_dicts()),
+        "report_to_columns": lambda: report().to_columns(),
+        "report_aggregate": lambda: report().aggregate(
+            by=["CampaignId"], sum=["Impressions", "Clicks", "Cost"]
+        ),
+        # The body of the streaming report is copied to the file without decoding.
+        "report_save_tsv_stream": lambda: stream_client.reports()
+        .post(data={"params": {}})()
+        .save(path=tsv_path),
+        "report_save_tsv_stream_extra_columns": lambda: stream_client.reports()
+        .post(data={"params": {}})()
+        .save(path=tsv_path, extra_columns={"login": "login"}),
+        "get_{}_pages".format(PAGES): lambda: consume(
+            client.campaigns()
+            .post(data={"method": "get", "params": {"FieldNames": ["Id", "Name"]}})()
+            .iter_items()
+        ),
+        "format_data_to_request_10000_objects": lambda: adapter.format_data_to_request(
+            set_body
+        ),
+        "retry_dispatch_1000_calls": retry_dispatch,
+    }
+
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = measure(func, repeat)
+        print("{:<45} {:>10.2f} ms".format(name, results[name] * 1000))
+    return results
+
+
+def compare(results: Dict[str, float], other: dict) -> None:
+    print("\nCompared with {} ({} rows):".format(other["version"], other["rows"]))
+    for name, seconds in results.items():
+        if name not in other["results"]:
+            continue
+        ratio = seconds / other["results"][name]
+        mark = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        print("{:<45} {:>6.2f}x{}".format(name, ratio, mark))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000, help="Rows of the report")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each benchmark")
+    parser.add_argument("--compare", type=Path, help="Results file to compare with")
+    parser.add_argument(
+        "--save",
+        type=Path,
+        default=RESULTS_PATH / "{}.json".format(tapi_yandex_direct.__version__),
+        help="Results file",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Overwrite the existing results file"
+    )
+    args = parser.parse_args()
+
+    if args.save.exists() and not args.force:
+        parser.error(
+            "--save {} already exists, pass another --save path "
+            "or --force to overwrite it".format(args.save)
+        )
+
+    other = None
+    if args.compare:
+        if args.compare.resolve() == args.save.resolve():
+            parser.error(
+                "--save {} would overwrite the compared results, "
+                "pass another --save path".format(args.save)
+            )
+        # Is read before the results are saved.
+        other = json.loads(args.compare.read_text())
+
+    # The log messages of the retries are not measured.
+    logging.disable(logging.CRITICAL)
+    results = run(args.rows, args.repeat)
+
+    args.save.parent.mkdir(parents=True, exist_ok=True)
+    args.save.write_text(
+        json.dumps(
+            {
+                "version": tapi_yandex_direct.__version__,
+                "date": str(dt.date.today()),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "rows": args.rows,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print("\nResults are saved to {}".format(args.save))
+
+    if other is not None:
+        compare(results, other)
+
+
+if __name__ == "__main__":
+    main()
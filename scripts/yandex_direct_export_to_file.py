@@ -1,11 +1,14 @@
 import argparse
 import csv
+import hashlib
 import json
 import logging
+import os
 from pathlib import Path
 from typing import Iterable, Optional
 
 from tapi_yandex_direct import YandexDirect, exceptions
+from tapi_yandex_direct.cache import create_report_name
 
 LOGGING_FORMAT = "%(asctime)s [%(levelname)s] %(pathname)s:%(funcName)s  %(message)s"
 
@@ -13,8 +16,12 @@ logging.basicConfig(format=LOGGING_FORMAT, level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-def create_report_name(body: dict, headers: dict):
-    return hash(str((body, headers)))
+def get_headers(use_operator_units: bool, return_money_in_micros: bool) -> dict:
+    """HTTP headers of the request, by their names in the API."""
+    return {
+        "Use-Operator-Units": str(use_operator_units).lower(),
+        "returnMoneyInMicros": str(return_money_in_micros).lower(),
+    }
 
 
 def prepare_body(body: dict, headers: dict):
@@ -26,31 +33,56 @@ def add_extra_data(row: dict, extra_columns: Iterable, login: Optional[str]):
         row["login"] = login
 
 
-def main(
-    client: YandexDirect,
-    body: dict,
-    headers: dict,
-    resource: str,
-    extra_columns: Iterable,
-    login: Optional[str],
-    filepath: Path,
-) -> None:
-    response = None
-    page_iterator = None
-    api_error_retries = 5
-    while True:
-        try:
-            if response is None:
-                resource_method = getattr(client, resource)
-                logger.info(f"Request resource '{resource}'")
-                response = resource_method().post(data=body, headers=headers)
+def get_fieldnames(body: dict, rows: Iterable[dict], extra_columns: Iterable) -> list:
+    """
+    Columns of the output: FieldNames of the request, then the other keys of the rows.
+    The columns are fixed by the first page, the API omits the fields without values.
+    """
+    fieldnames = list(body["params"].get("FieldNames", []))
+    for row in rows:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    return fieldnames + [column for column in extra_columns if column not in fieldnames]
+
+
+def get_checkpoint_path(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".checkpoint")
+
+
+def get_part_path(filepath: Path, page_number: int) -> Path:
+    return filepath.with_name(f"{filepath.name}.part{page_number:05d}")
 
-            if resource != "reports":
 
-                if page_iterator is None:
-                    page_iterator = response().pages()
+def get_export_hash(body: dict, extra_columns: Iterable, parts: bool) -> str:
+    """The output written before the checkpoint depends on all of these arguments."""
+    export = {"body": body, "extra_columns": list(extra_columns), "parts": parts}
+    return hashlib.sha1(json.dumps(export, sort_keys=True).encode()).hexdigest()
 
-                page = next(page_iterator)
+
+def load_checkpoint(checkpoint_path: Path, export_hash: str) -> Optional[dict]:
+    if not checkpoint_path.exists():
+        return None
+
+    checkpoint = json.loads(checkpoint_path.read_text())
+    if checkpoint.get("export") != export_hash:
+        raise ValueError(
+            f"Checkpoint {checkpoint_path} was created for another request body, "
+            f"extra columns or --parts, delete it to start the export over"
+        )
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path: Path, checkpoint: dict) -> None:
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(checkpoint))
+    os.replace(tmp_path, checkpoint_path)
+
+
+def post(client: YandexDirect, resource: str, body: dict, headers: dict):
+    api_error_retries = 5
+    while True:
+        try:
+            logger.info(f"Request resource '{resource}'")
+            return getattr(client, resource)().post(data=body, headers=headers)
 
         except exceptions.YandexDirectClientError as exc:
             error_code = int(exc.error_code)
@@ -68,50 +100,141 @@ def main(
                 continue
             raise
 
-        except StopIteration:
+
+def export_report(
+    client: YandexDirect,
+    body: dict,
+    headers: dict,
+    extra_columns: Iterable,
+    login: Optional[str],
+    filepath: Path,
+    format: str = "tsv",
+) -> None:
+    while True:
+        response = post(client, "reports", body, headers)
+        if response.status_code not in (201, 202):
             break
 
-        else:
-            if resource == "reports":
-                if response.status_code in (201, 202):
-                    response = None
-                    continue
+    extra_values = {}
+    if "login" in extra_columns:
+        extra_values["login"] = login
 
-            logger.info(f"Save data to {filepath}")
+    logger.info(f"Save data to {filepath}")
+    response().save(path=filepath, format=format, extra_columns=extra_values)
 
-            if resource == "reports":
-                if extra_columns:
-                    with open(filepath, "w", newline='') as csvfile:
-                        data_iterator = response().iter_dicts()
 
-                        for i, row in enumerate(data_iterator):
-                            if i == 0:
-                                writer = csv.DictWriter(
-                                    csvfile, fieldnames=row.keys(), dialect="excel-tab",
-                                )
-                                writer.writeheader()
+def export_pages(
+    client: YandexDirect,
+    body: dict,
+    headers: dict,
+    resource: str,
+    extra_columns: Iterable,
+    login: Optional[str],
+    filepath: Path,
+    parts: bool = False,
+) -> None:
+    """
+    Exports all pages of the resource.
+
+    After each page, the offset of the next page is written to the checkpoint file
+    next to the output file. If the checkpoint exists, the export is resumed from it.
+    """
+    checkpoint_path = get_checkpoint_path(filepath)
+    export_hash = get_export_hash(body, extra_columns, parts)
+    checkpoint = load_checkpoint(checkpoint_path, export_hash)
+    if (
+        checkpoint is not None
+        and not parts
+        and (not filepath.exists() or filepath.stat().st_size < checkpoint["size"])
+    ):
+        logger.warning(f"Output file {filepath} is missing or cut, start export over")
+        checkpoint = None
+
+    if checkpoint is None:
+        checkpoint = {
+            "export": export_hash,
+            "offset": 0,
+            "page_number": 0,
+            "size": 0,
+            "fieldnames": None,
+        }
+    elif not parts:
+        logger.info(f"Resume export from offset {checkpoint['offset']}")
+        # Rows written after the last checkpoint will be requested again.
+        with open(filepath, "r+b") as f:
+            f.truncate(checkpoint["size"])
+
+    while True:
+        if checkpoint["offset"]:
+            body["params"].setdefault("Page", {})["Offset"] = checkpoint["offset"]
 
-                            add_extra_data(row, extra_columns, login)
-                            writer.writerow(row)
-                else:
-                    with open(filepath, "w") as csvfile:
-                        csvfile.write(response.data)
+        response = post(client, resource, body, headers)
+        rows = response().extract()
 
-                # The report has no pagination.
-                break
+        if rows:
+            if checkpoint["fieldnames"] is None:
+                checkpoint["fieldnames"] = get_fieldnames(body, rows, extra_columns)
+
+            if parts:
+                page_path = get_part_path(filepath, checkpoint["page_number"])
+                mode = "w"
             else:
-                with open(filepath, "w", newline='') as csvfile:
-                    data_iterator = page().items()
+                page_path = filepath
+                mode = "a" if checkpoint["size"] else "w"
+
+            logger.info(f"Save data to {page_path}")
+            with open(page_path, mode, newline="") as csvfile:
+                writer = csv.DictWriter(
+                    csvfile,
+                    fieldnames=checkpoint["fieldnames"],
+                    restval="",
+                    extrasaction="ignore",
+                    dialect="excel-tab",
+                )
+                if mode == "w":
+                    writer.writeheader()
+
+                for row in rows:
+                    add_extra_data(row, extra_columns, login)
+                    skipped = row.keys() - set(checkpoint["fieldnames"])
+                    if skipped:
+                        logger.warning(f"Fields {sorted(skipped)} are not exported")
+                    writer.writerow(row)
+
+                csvfile.flush()
+                os.fsync(csvfile.fileno())
+                if not parts:
+                    checkpoint["size"] = csvfile.tell()
+
+        limited_by = response.data["result"].get("LimitedBy")
+        if not limited_by:
+            break
 
-                    for i, row in enumerate(data_iterator):
-                        if i == 0:
-                            writer = csv.DictWriter(
-                                csvfile, fieldnames=row.keys(), dialect="excel-tab"
-                            )
-                            writer.writeheader()
+        checkpoint["offset"] = limited_by
+        checkpoint["page_number"] += 1
+        save_checkpoint(checkpoint_path, checkpoint)
 
-                        add_extra_data(row, extra_columns, login)
-                        writer.writerow(row)
+    if checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+
+def main(
+    client: YandexDirect,
+    body: dict,
+    headers: dict,
+    resource: str,
+    extra_columns: Iterable,
+    login: Optional[str],
+    filepath: Path,
+    format: str = "tsv",
+    parts: bool = False,
+) -> None:
+    if resource == "reports":
+        export_report(client, body, headers, extra_columns, login, filepath, format)
+    else:
+        export_pages(
+            client, body, headers, resource, extra_columns, login, filepath, parts
+        )
 
 
 if __name__ == "__main__":
@@ -152,6 +275,19 @@ if __name__ == "__main__":
         type=str,
         help="File path for save data",
     )
+    parser.add_argument(
+        "--format",
+        required=False,
+        type=str,
+        choices=["tsv", "csv", "jsonl", "parquet"],
+        default="tsv",
+        help="File format of the report, parquet requires pyarrow",
+    )
+    parser.add_argument(
+        "--parts",
+        action="store_true",
+        help="Write each page to a separate file <filepath>.partNNNNN",
+    )
     parser.add_argument(
         "--use_operator_units",
         required=False,
@@ -219,11 +355,10 @@ if __name__ == "__main__":
         retry_if_exceeded_limit=True,
         retries_if_server_error=5,
         wait_report=True,
+        stream_report=True,
+        return_money_in_micros=args.return_money_in_micros,
     )
-    headers = {
-        "use_operator_units": str(args.use_operator_units),
-        "return_money_in_micros": str(args.return_money_in_micros),
-    }
+    headers = get_headers(args.use_operator_units, args.return_money_in_micros)
 
     with open(args.body_filepath) as f:
         body_text = f.read()
@@ -239,5 +374,7 @@ if __name__ == "__main__":
         args.resource,
         args.extra_columns,
         args.login,
-        args.filepath,
+        Path(args.filepath),
+        args.format,
+        args.parts,
     )
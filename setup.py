@@ -36,6 +36,15 @@ setup(
     packages=[package],
     include_package_data=False,
     install_requires=["requests", "orjson", "tapi-wrapper2>=0.1.2,<1.0"],
+    extras_require={
+        "async": ["httpx"],
+        "arrow": ["pyarrow"],
+        "pandas": ["pyarrow", "pandas"],
+        "parquet": ["pyarrow"],
+        "prometheus": ["prometheus-client"],
+        "opentelemetry": ["opentelemetry-api"],
+        "redis": ["redis"],
+    },
     license="MIT",
     zip_safe=False,
     keywords="tapi,wrapper,yandex,metrika,api,direct,яндекс,директ,апи",
@@ -5,4 +5,5 @@ __version__ = '2021.5.29'
 
 
 from .resource_mapping import *
-from .tapi_yandex_direct import YandexDirect
+from .tapi_yandex_direct import YandexDirect, create_session
+from .async_client import AsyncYandexDirect
@@ -0,0 +1,265 @@
+import asyncio
+import datetime as dt
+import logging
+import time
+from typing import Optional, AsyncIterator
+
+import requests
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from tapi2.exceptions import ResponseProcessException
+from tapi2.tapi import TapiClient
+
+from tapi_yandex_direct import limiter
+from tapi_yandex_direct.resource_mapping import RESOURCE_MAPPING_V5
+from tapi_yandex_direct.tapi_yandex_direct import (
+    YandexDirectClientAdapter,
+    get_request_delay,
+    release_request,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def to_requests_response(response, method: str) -> Response:
+    """Converts the httpx response so that the adapter can process it."""
+    result = Response()
+    result.status_code = response.status_code
+    result.reason = response.reason_phrase
+    result.headers = CaseInsensitiveDict(response.headers)
+    result.url = str(response.url)
+    result.encoding = response.encoding
+    result._content = response.content
+    result._content_consumed = True
+    result.request = requests.Request(method, result.url).prepare()
+    return result
+
+
+NOT_ASYNC_REQUEST_MESSAGE = (
+    "The response of the asynchronous client does not send requests, "
+    "use 'async for' with the pages() and iter_items() methods of the resource, "
+    "for example client.campaigns().iter_items(data=body)"
+)
+
+
+class AsyncResponseSession(requests.Session):
+    """
+    Session of the responses of the asynchronous client.
+
+    The methods of the responses that request the next pages, like iter_items() and pages(),
+    would send blocking requests in the event loop, past the units limiter.
+    """
+
+    def request(self, *args, **kwargs):
+        raise TypeError(NOT_ASYNC_REQUEST_MESSAGE)
+
+
+ASYNC_RESPONSE_SESSION = AsyncResponseSession()
+
+
+class AsyncYandexDirectClientAdapter(YandexDirectClientAdapter):
+    def prefetch_pages(self, *args, **kwargs):
+        raise TypeError(NOT_ASYNC_REQUEST_MESSAGE)
+
+
+class AsyncYandexDirectExecutor:
+    def __init__(self, client: "AsyncYandexDirect", resource_name: str):
+        self._client = client
+        self._resource_name = resource_name
+        self._resource = RESOURCE_MAPPING_V5[resource_name]
+        self._adapter = client.adapter_class()
+        self._store = {}
+
+    @property
+    def url(self) -> str:
+        api_root = self._adapter.get_api_root(
+            self._client.api_params, resource_name=self._resource_name
+        )
+        return api_root.rstrip("/") + "/" + self._resource["resource"].lstrip("/")
+
+    def _wrap_in_tapi(self, data, response: Response, request_kwargs: dict):
+        return TapiClient(
+            self._adapter,
+            data=data,
+            response=response,
+            request_kwargs=request_kwargs,
+            api_params=self._client.api_params,
+            resource=self._resource,
+            resource_name=self._resource_name,
+            store=self._store,
+            session=ASYNC_RESPONSE_SESSION,
+        )
+
+    def _context(self, **kwargs) -> dict:
+        return {
+            "api_params": self._client.api_params,
+            "store": self._store,
+            "client": None,
+            "resource_name": self._resource_name,
+            **kwargs
+        }
+
+    async def _make_request(
+        self, request_method: str, repeat_number: int = 0, **kwargs
+    ):
+        kwargs.setdefault("url", self.url)
+        api_params = self._client.api_params
+        pause_start = time.time_ns()
+        delay = get_request_delay(api_params, kwargs["url"])
+        while delay is None:
+            await asyncio.sleep(limiter.SLOT_POLL_INTERVAL)
+            delay = get_request_delay(api_params, kwargs["url"])
+        if delay:
+            await asyncio.sleep(delay)
+
+        start = time.time_ns()
+        try:
+            request_kwargs = self._adapter.get_request_kwargs(
+                api_params, request_method, **kwargs
+            )
+            response = await self._client.send(request_method, request_kwargs)
+        finally:
+            release_request(api_params)
+        response.request_times = (pause_start, start)
+
+        response_data = None
+        try:
+            response_data = self._adapter.process_response(
+                **self._context(response=response, request_kwargs=request_kwargs)
+            )
+        except ResponseProcessException as e:
+            repeat_number += 1
+            client = self._wrap_in_tapi(e.data, response, request_kwargs)
+            context = self._context(
+                response=response, request_kwargs=request_kwargs, client=client
+            )
+            error_message = self._adapter.get_error_message(
+                data=e.data, response=response
+            )
+            tapi_exception = e.tapi_exception(message=error_message, client=client)
+
+            sleep = self._adapter._get_retry_sleep(
+                tapi_exception, error_message, repeat_number, **context
+            )
+            if sleep is not None:
+                with self._adapter._trace_sleep(sleep, **context):
+                    await asyncio.sleep(sleep)
+                return await self._make_request(
+                    request_method, repeat_number=repeat_number, **kwargs
+                )
+
+            self._adapter.error_handling(
+                tapi_exception, error_message, repeat_number, **context
+            )
+
+        return self._wrap_in_tapi(response_data, response, request_kwargs)
+
+    async def get(self, **kwargs) -> TapiClient:
+        return await self._make_request("GET", **kwargs)
+
+    async def post(self, **kwargs) -> TapiClient:
+        return await self._make_request("POST", **kwargs)
+
+    async def pages(
+        self, *, max_pages: int = None, **kwargs
+    ) -> AsyncIterator[TapiClient]:
+        """Sends a POST request and iterates over all pages of the result."""
+        response = await self.post(**kwargs)
+        page_count = 0
+
+        while True:
+            executor = response()
+            for page in executor._get_iterator_pages():
+                yield executor._wrap_in_tapi(page)
+                page_count += 1
+
+            if max_pages is not None and page_count >= max_pages:
+                break
+
+            next_request_kwargs = executor._get_iterator_next_request_kwargs()
+            if not next_request_kwargs:
+                break
+
+            response = await self.post(**next_request_kwargs)
+
+    async def iter_items(
+        self, *, max_pages: int = None, max_items: int = None, **kwargs
+    ) -> AsyncIterator[dict]:
+        """Sends a POST request and iterates over the items of all pages."""
+        item_count = 0
+        async for page in self.pages(max_pages=max_pages, **kwargs):
+            for item in page().items():
+                if max_items is not None and item_count >= max_items:
+                    return
+                yield item
+                item_count += 1
+
+
+class AsyncYandexDirect:
+    """
+    Asynchronous client, accepts the same parameters as YandexDirect.
+
+        async with AsyncYandexDirect(access_token=ACCESS_TOKEN) as client:
+            campaigns = await client.campaigns().post(data=body)
+            print(campaigns().extract())
+
+    The response objects are the same as those of the synchronous client.
+    Requires the httpx library, 'pip install tapi-yandex-direct[async]'.
+    """
+
+    adapter_class = AsyncYandexDirectClientAdapter
+
+    def __init__(self, *, session=None, **api_params):
+        """
+        :param session: httpx.AsyncClient, created automatically if not specified.
+        :param api_params: parameters of the YandexDirect client.
+        """
+        self.api_params = api_params
+        self._session = session
+        self._own_session = session is None
+
+    def for_login(self, login: Optional[str]) -> "AsyncYandexDirect":
+        """Client with the same parameters and connection pool for another login."""
+        return self.__class__(
+            session=self.session, **{**self.api_params, "login": login}
+        )
+
+    @property
+    def session(self):
+        if self._session is None:
+            import httpx
+
+            self._session = httpx.AsyncClient(timeout=None)
+        return self._session
+
+    async def send(self, request_method: str, request_kwargs: dict) -> Response:
+        start = time.monotonic()
+        response = await self.session.request(
+            request_method,
+            request_kwargs["url"],
+            params=request_kwargs.get("params"),
+            content=request_kwargs.get("data"),
+            headers=request_kwargs.get("headers"),
+        )
+        result = to_requests_response(response, request_method)
+        result.elapsed = dt.timedelta(seconds=time.monotonic() - start)
+        return result
+
+    async def aclose(self) -> None:
+        if self._own_session and self._session is not None:
+            await self._session.aclose()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncYandexDirect":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    def __getattr__(self, name: str):
+        if name in RESOURCE_MAPPING_V5:
+            return lambda: AsyncYandexDirectExecutor(self, name)
+        raise AttributeError("Undeclared resource '{}'".format(name))
+
+    def __dir__(self):
+        return list(RESOURCE_MAPPING_V5.keys())
@@ -0,0 +1,146 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from tapi2.tapi import TapiClientExecutor
+
+from tapi_yandex_direct.tapi_yandex_direct import copy_executor
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of objects or IDs in one request.
+DEFAULT_BATCH_LIMIT = 1000
+BATCH_LIMITS = {
+    ("campaigns", "add"): 10,
+    ("campaigns", "update"): 10,
+    ("adgroups", "get"): 10000,
+    ("adgroups", "get", "CampaignIds"): 10,
+    ("ads", "get"): 10000,
+    ("ads", "get", "CampaignIds"): 10,
+    ("keywords", "get"): 10000,
+    ("keywords", "update"): 10000,
+    ("keywordbids", "set"): 10000,
+    ("bids", "set"): 10000,
+}
+# Arrays of IDs in the SelectionCriteria that are split into batches.
+CRITERIA_KEYS = ("Ids", "CampaignIds")
+
+
+def get_batch_limit(
+    resource_name: str, method: str, criteria_key: Optional[str] = None
+) -> int:
+    """:param criteria_key: array of IDs in the SelectionCriteria, see get_criteria_keys."""
+    return BATCH_LIMITS.get(
+        (resource_name, method, criteria_key),
+        BATCH_LIMITS.get((resource_name, method), DEFAULT_BATCH_LIMIT),
+    )
+
+
+def get_criteria_keys(params: dict) -> List[str]:
+    """Arrays of IDs in the SelectionCriteria of the request params."""
+    criteria = params.get("SelectionCriteria")
+    if isinstance(criteria, dict):
+        return [key for key in CRITERIA_KEYS if key in criteria]
+    return []
+
+
+def get_batch_path(params: dict) -> Tuple[str, ...]:
+    """Path to the array of objects in the request params."""
+    keys = [key for key, value in params.items() if isinstance(value, list)]
+    if len(keys) != 1:
+        raise ValueError(
+            "Could not determine the array of objects to split into batches, "
+            "found arrays: {}".format(keys)
+        )
+    return (keys[0],)
+
+
+def split_array(data: dict, path: Tuple[str, ...], limit: int) -> List[dict]:
+    """Splits the request body into bodies with no more than limit items of the array."""
+    array = data["params"]
+    for key in path:
+        array = array[key]
+
+    bodies = []
+    for i in range(0, len(array), limit):
+        body = {**data, "params": dict(data["params"])}
+        container = body["params"]
+        for key in path[:-1]:
+            container[key] = dict(container[key])
+            container = container[key]
+        container[path[-1]] = array[i : i + limit]
+        bodies.append(body)
+
+    return bodies or [data]
+
+
+def split_request(
+    data: dict, limit: int, criteria_limits: Dict[str, int] = None
+) -> List[dict]:
+    """
+    Splits the request body into bodies with no more than limit IDs or objects.
+
+    Each array of IDs in the SelectionCriteria is split,
+    the bodies get all combinations of their parts.
+
+    :param criteria_limits: limits of the arrays of IDs by key, by default limit.
+    """
+    criteria_keys = get_criteria_keys(data["params"])
+    if not criteria_keys:
+        if data["method"] == "get":
+            return [data]
+        return split_array(data, get_batch_path(data["params"]), limit)
+
+    bodies = [data]
+    for key in criteria_keys:
+        key_limit = (criteria_limits or {}).get(key, limit)
+        bodies = [
+            part
+            for body in bodies
+            for part in split_array(body, ("SelectionCriteria", key), key_limit)
+        ]
+    return bodies
+
+
+def post_batches(
+    executor: TapiClientExecutor, data: dict, *, workers: int = 4, limit: int = None
+) -> List[dict]:
+    """
+    Sends a request with any number of IDs or objects.
+
+    The request is split into batches by the limit of the API method,
+    the batches are sent concurrently and their results are merged in the order of input.
+    All pages of the get method are requested.
+
+        results = post_batches(client.keywordbids(), data=body, workers=8)
+
+    :param executor: resource, for example client.keywordbids()
+    :param data: request body.
+    :param workers: number of requests in flight.
+    :param limit: size of batch, by default the limit of the API method.
+    :return: extracted results, as the extract() method.
+    """
+    method = data["method"]
+    criteria_limits = None
+    if limit is None:
+        resource_name = executor._resource_name
+        limit = get_batch_limit(resource_name, method)
+        criteria_limits = {
+            key: get_batch_limit(resource_name, method, key)
+            for key in get_criteria_keys(data["params"])
+        }
+    bodies = split_request(data, limit, criteria_limits)
+    logger.info("Request '{}' is split into {} batches".format(method, len(bodies)))
+
+    def send(body: dict) -> List[dict]:
+        response = copy_executor(executor).post(data=body)
+        if method == "get":
+            return list(response().iter_items())
+        return response().extract()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = []
+        for batch_results in pool.map(send, bodies):
+            results.extend(batch_results)
+
+    return results
@@ -0,0 +1,378 @@
+import collections
+import datetime as dt
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Union
+
+import orjson
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+API_URLS = (
+    "https://api.direct.yandex.com/json/v5/",
+    "https://api-sandbox.direct.yandex.com/json/v5/",
+)
+REPORTS_URLS = tuple(url + "reports" for url in API_URLS)
+# Headers that change the content of the response, besides the account.
+RESPONSE_HEADERS = ("Accept-Language",)
+# Headers that change the content of the report, besides the account.
+REPORT_HEADERS = (
+    "Accept-Language",
+    "returnMoneyInMicros",
+    "skipReportHeader",
+    "skipColumnHeader",
+    "skipReportSummary",
+)
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_account_key(headers) -> Optional[str]:
+    """
+    Account of the request: the login of the Client-Login header,
+    without it the hash of the token, so that the responses of different accounts
+    do not get the same cache key.
+    """
+    login = headers.get("Client-Login")
+    if login:
+        return login
+
+    token = headers.get("Authorization")
+    if token:
+        return hashlib.sha1(token.encode()).hexdigest()
+    return None
+
+
+def build_response(
+    request: PreparedRequest, headers, adapter: Optional[HTTPAdapter]
+) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    response.connection = adapter
+    return response
+
+
+def is_closed_date_range(body: dict, today: dt.date = None) -> bool:
+    """The report period has ended, so the report data no longer changes."""
+    params = body.get("params", {})
+    if params.get("DateRangeType") != "CUSTOM_DATE":
+        return False
+
+    date_to = params.get("SelectionCriteria", {}).get("DateTo")
+    return bool(date_to) and date_to < str(today or dt.date.today())
+
+
+def create_report_name(body: dict, headers: dict) -> str:
+    """
+    Stable name of the report by its parameters.
+
+    Identical requests get the same name, regardless of the ReportName in the body.
+    Reports with a relative period are named differently every day.
+    """
+    params = {
+        key: value for key, value in body["params"].items() if key != "ReportName"
+    }
+    headers = CaseInsensitiveDict(headers)
+    key = {
+        "params": params,
+        "account": get_account_key(headers),
+        "headers": {name: headers.get(name) for name in REPORT_HEADERS},
+    }
+    if not is_closed_date_range(body):
+        key["date"] = str(dt.date.today())
+
+    return hashlib.sha1(orjson.dumps(key, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class CachedReportFile(io.FileIO):
+    def release_conn(self) -> None:
+        self.close()
+
+
+def build_cached_report_response(
+    request: PreparedRequest, filepath: Path, headers, stream: bool
+) -> Response:
+    response = build_response(request, headers, None)
+    if stream:
+        response.raw = CachedReportFile(filepath)
+    else:
+        response._content = filepath.read_bytes()
+        response._content_consumed = True
+    return response
+
+
+class ReportCache:
+    """
+    Local cache of the reports with a closed period.
+
+    Only reports whose DateTo has passed are cached,
+    the cache key is the stable name of the report from create_report_name.
+    The cache serves only the clients it is passed to.
+
+        cache = ReportCache("reports-cache", ttl=60 * 60 * 24, max_size=10 * 1024 ** 3)
+        client = YandexDirect(access_token=ACCESS_TOKEN, report_cache=cache)
+    """
+
+    # URLs of the requests served by the cache.
+    urls = REPORTS_URLS
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        ttl: Optional[float] = None,
+        max_size: Optional[int] = None,
+    ):
+        """
+        :param path: cache directory.
+        :param ttl: lifetime of the report in seconds, by default unlimited.
+        :param max_size: maximum size of the cache in bytes, old reports are deleted first.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _filepath(self, name: str) -> Path:
+        return self.path / "{}.tsv".format(name)
+
+    def _is_expired(self, filepath: Path, now: float) -> bool:
+        return self.ttl is not None and now - filepath.stat().st_mtime > self.ttl
+
+    def get(self, name: str) -> Optional[Path]:
+        filepath = self._filepath(name)
+        if not filepath.exists() or self._is_expired(filepath, time.time()):
+            return None
+        return filepath
+
+    def put(self, name: str, chunks: Iterable[bytes]) -> Path:
+        filepath = self._filepath(name)
+        # The temporary file is unique for each thread and process
+        # that downloads the same report.
+        f = tempfile.NamedTemporaryFile(dir=self.path, suffix=".tmp", delete=False)
+        try:
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(f.name, filepath)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+        self.evict()
+        return filepath
+
+    def evict(self) -> None:
+        """Deletes expired reports and the oldest reports above max_size."""
+        now = time.time()
+        files = sorted(self.path.glob("*.tsv"), key=lambda f: f.stat().st_mtime)
+        for filepath in list(files):
+            if self._is_expired(filepath, now):
+                filepath.unlink()
+                files.remove(filepath)
+
+        if self.max_size is not None:
+            size = sum(filepath.stat().st_size for filepath in files)
+            for filepath in files[:-1]:
+                if size <= self.max_size:
+                    break
+                size -= filepath.stat().st_size
+                filepath.unlink()
+
+    def clear(self) -> None:
+        for filepath in self.path.glob("*.tsv"):
+            filepath.unlink()
+
+    def send(
+        self,
+        request: PreparedRequest,
+        send: Callable[[], Response],
+        stream: bool = False,
+    ) -> Response:
+        """
+        Serves the report from the cache, otherwise sends the request
+        and saves the report to the cache.
+        """
+        body = orjson.loads(request.body) if request.body else {}
+        if not is_closed_date_range(body):
+            return send()
+
+        name = create_report_name(body, request.headers)
+        filepath = self.get(name)
+        if filepath is not None:
+            logger.info("Report is read from the cache {}".format(filepath))
+            headers = {"Content-Type": "text/tab-separated-values"}
+            return build_cached_report_response(request, filepath, headers, stream)
+
+        response = send()
+        if response.status_code == 200:
+            filepath = self.put(name, response.iter_content(CHUNK_SIZE))
+            response = build_cached_report_response(
+                request, filepath, response.headers, stream
+            )
+        return response
+
+
+class MemoryCacheBackend:
+    """LRU cache in memory."""
+
+    def __init__(self, max_size: int = 1024):
+        """:param max_size: maximum number of responses."""
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, expires: float) -> None:
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class SqliteCacheBackend:
+    """Cache in the sqlite database, is shared by processes and saved between runs."""
+
+    def __init__(self, path: Union[str, Path]):
+        """:param path: database file."""
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+            )
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires >= ?",
+                (key, time.time()),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: bytes, expires: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM responses WHERE expires < ?", (time.time(),)
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, value, expires),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """
+    Cache of the responses of the get method for reference resources.
+
+    Only resources with a TTL are cached.
+    The cache key is the resource, the request body and the account
+    (the login or the hash of the token),
+    so each page of the pages() iterator is cached separately.
+    The cache serves only the clients it is passed to.
+
+        cache = ResponseCache(ttl={"dictionaries": 60 * 60 * 24, "clients": 60 * 60})
+        client = YandexDirect(access_token=ACCESS_TOKEN, response_cache=cache)
+    """
+
+    urls = API_URLS
+
+    def __init__(self, ttl: Dict[str, float], backend=None):
+        """
+        :param ttl: lifetime of the responses in seconds by resource,
+            resource is the last part of the URL, for example "dynamictextadtargets".
+        :param backend: MemoryCacheBackend (by default) or SqliteCacheBackend.
+        """
+        self.ttl = ttl
+        self.backend = backend or MemoryCacheBackend()
+
+    def get_ttl(self, request: PreparedRequest) -> Optional[float]:
+        return self.ttl.get(request.path_url.rstrip("/").rsplit("/", 1)[-1])
+
+    def get_key(self, request: PreparedRequest) -> Optional[str]:
+        """Cache key of the request, None if the request is not cached."""
+        if not request.body or not self.get_ttl(request):
+            return None
+
+        body = orjson.loads(request.body)
+        if body.get("method") != "get":
+            return None
+
+        key = {
+            "url": request.url,
+            "body": body,
+            "account": get_account_key(request.headers),
+            "headers": {name: request.headers.get(name) for name in RESPONSE_HEADERS},
+        }
+        return hashlib.sha1(orjson.dumps(key, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def send(
+        self,
+        request: PreparedRequest,
+        send: Callable[[], Response],
+        stream: bool = False,
+    ) -> Response:
+        """
+        Serves the response from the cache, otherwise sends the request
+        and saves the response without errors to the cache.
+        """
+        key = self.get_key(request)
+        if key is None:
+            return send()
+
+        content = self.backend.get(key)
+        if content is not None:
+            logger.debug("Response is read from the cache")
+            response = build_response(
+                request, {"Content-Type": "application/json"}, None
+            )
+            response._content = content
+            response._content_consumed = True
+            return response
+
+        response = send()
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            if isinstance(data, dict) and "error" not in data:
+                self.backend.set(
+                    key, response.content, time.time() + self.get_ttl(request)
+                )
+        return response
@@ -0,0 +1,395 @@
+"""
+Local emulator of the Yandex Direct API for load and concurrency testing.
+
+    with ApiEmulator(latency=0.05, error_rates={52: 0.01}) as emulator:
+        client = YandexDirect(access_token="", api_root=emulator.url)
+        client.campaigns().post(data=body)
+
+    python -m tapi_yandex_direct.emulator --port 8080 --latency 0.05
+"""
+import argparse
+import collections
+import datetime as dt
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from tapi_yandex_direct import report_fields
+from tapi_yandex_direct.resource_mapping import RESOURCE_MAPPING_V5
+from tapi_yandex_direct.tapi_yandex_direct import RESULT_DICTIONARY_KEYS_OF_API_METHODS
+
+logger = logging.getLogger(__name__)
+
+ERROR_STRINGS = {
+    52: "Server temporarily unavailable",
+    56: "Method request limit exceeded",
+    152: "Not enough units",
+    506: "Limit on the number of concurrent requests exceeded",
+    9000: "Limit on the number of reports in the offline queue exceeded",
+}
+REPORTS_PATH = "/json/v5/reports"
+
+
+class ApiEmulator:
+    """
+    HTTP server on localhost that answers like the JSON v5 API.
+
+    - get returns synthetic objects split into pages with LimitedBy,
+      other methods return a result for each passed object;
+    - each request spends units of the login, the Units header is returned,
+      error 152 when the daily limit is spent;
+    - error 506 when the login has more than max_concurrent_requests in flight;
+    - offline reports are queued and answered 201/202 with retryIn until ready,
+      error 9000 when the queue of the login is full;
+    - errors 52, 56, 152, 506, 9000 can be injected randomly or on the next requests.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        objects_count: int = 1000,
+        page_limit: int = 10000,
+        units_limit: int = 64000,
+        units_cost: int = 10,
+        max_concurrent_requests: Optional[int] = None,
+        report_delay: float = 0.0,
+        report_rows: int = 1000,
+        retry_in: int = 1,
+        max_reports_in_queue: int = 5,
+        error_rates: Dict[int, float] = None,
+        seed: int = None,
+    ):
+        """
+        :param port: port of the server, by default a free port.
+        :param latency: seconds before each response.
+        :param objects_count: number of objects of each resource.
+        :param page_limit: page size if Page.Limit is not passed.
+        :param units_limit: daily units of each login.
+        :param units_cost: units spent by each request.
+        :param max_concurrent_requests: requests of a login in flight, by default unlimited.
+        :param report_delay: seconds of generation of the offline report.
+        :param report_rows: rows of each report.
+        :param retry_in: value of the retryIn header of the reports in the queue.
+        :param max_reports_in_queue: offline reports of a login in the queue.
+        :param error_rates: probability of each error code on a request.
+        :param seed: seed of the random errors.
+        """
+        self.port = port
+        self.latency = latency
+        self.objects_count = objects_count
+        self.page_limit = page_limit
+        self.units_limit = units_limit
+        self.units_cost = units_cost
+        self.max_concurrent_requests = max_concurrent_requests
+        self.report_delay = report_delay
+        self.report_rows = report_rows
+        self.retry_in = retry_in
+        self.max_reports_in_queue = max_reports_in_queue
+        self.error_rates = error_rates or {}
+        self.requests_count = collections.Counter()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._injected_errors = collections.deque()
+        self._spent_units = collections.Counter()
+        self._in_flight = collections.Counter()
+        # Offline reports by login and report name, the value is the ready time.
+        self._reports = collections.defaultdict(dict)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """API root for the api_root parameter of the client."""
+        return "http://127.0.0.1:{}/".format(self._server.server_address[1])
+
+    def start(self) -> "ApiEmulator":
+        handler = type("Handler", (EmulatorRequestHandler,), {"emulator": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("API emulator is started on {}".format(self.url))
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "ApiEmulator":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def inject_error(self, error_code: int, count: int = 1) -> None:
+        """The next count requests will be answered with the error."""
+        with self._lock:
+            self._injected_errors.extend([error_code] * count)
+
+    def reset_units(self) -> None:
+        with self._lock:
+            self._spent_units.clear()
+
+    def _error(self, error_code: int) -> dict:
+        return {
+            "error": {
+                "request_id": uuid.uuid4().hex,
+                "error_code": error_code,
+                "error_string": ERROR_STRINGS.get(error_code, "Error"),
+                "error_detail": "",
+            }
+        }
+
+    def _get_injected_error(self) -> Optional[int]:
+        with self._lock:
+            if self._injected_errors:
+                return self._injected_errors.popleft()
+
+        for error_code, rate in self.error_rates.items():
+            if self._random.random() < rate:
+                return error_code
+        return None
+
+    def _spend_units(self, login: str) -> Tuple[bool, str]:
+        """Returns whether the units are enough and the Units header."""
+        with self._lock:
+            spent = self._spent_units[login]
+            if spent + self.units_cost > self.units_limit:
+                return False, "0/{}/{}".format(
+                    self.units_limit - spent, self.units_limit
+                )
+            self._spent_units[login] = spent + self.units_cost
+            return True, "{}/{}/{}".format(
+                self.units_cost,
+                self.units_limit - spent - self.units_cost,
+                self.units_limit,
+            )
+
+    def handle(
+        self, path: str, headers, body: dict
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Returns the status code, headers and body of the response."""
+        login = headers.get("Client-Login", "")
+        with self._lock:
+            self.requests_count[path] += 1
+            self._in_flight[login] += 1
+            in_flight = self._in_flight[login]
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+
+            if (
+                self.max_concurrent_requests is not None
+                and in_flight > self.max_concurrent_requests
+            ):
+                return 200, {}, orjson.dumps(self._error(506))
+
+            error_code = self._get_injected_error()
+            if error_code is not None:
+                return 200, {}, orjson.dumps(self._error(error_code))
+
+            if path == REPORTS_PATH:
+                return self._handle_report(login, headers, body)
+
+            enough, units = self._spend_units(login)
+            if not enough:
+                return 200, {"Units": units}, orjson.dumps(self._error(152))
+
+            result = self._handle_method(path, body)
+            return 200, {"Units": units}, orjson.dumps({"result": result})
+        finally:
+            with self._lock:
+                self._in_flight[login] -= 1
+
+    def _create_object(self, id_: int, field_names: List[str]) -> dict:
+        item = {}
+        for field in field_names:
+            if field == "Id":
+                item[field] = id_
+            elif field.endswith("Id"):
+                item[field] = id_ % 100 + 1
+            else:
+                item[field] = "{} {}".format(field, id_)
+        return item
+
+    def _handle_method(self, path: str, body: dict) -> dict:
+        method = body.get("method")
+        params = body.get("params", {})
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+        if method == "checkDictionaries":
+            return {"Timestamp": now}
+        elif method == "checkCampaigns":
+            return {"Timestamp": now, "Campaigns": []}
+        elif method == "check":
+            return {"Timestamp": now, "Modified": {}}
+
+        elif method == "get":
+            criteria = params.get("SelectionCriteria", {})
+            page = params.get("Page", {})
+            offset = page.get("Offset", 0)
+            limit = page.get("Limit", self.page_limit)
+            if "Ids" in criteria:
+                ids = [id_ for id_ in criteria["Ids"] if 0 < id_ <= self.objects_count]
+            else:
+                ids = range(1, self.objects_count + 1)
+
+            field_names = params.get("FieldNames", ["Id"])
+            key = RESULT_DICTIONARY_KEYS_OF_API_METHODS["get"].get(path, "Items")
+            result = {
+                key: [
+                    self._create_object(id_, field_names)
+                    for id_ in ids[offset : offset + limit]
+                ]
+            }
+            if offset + limit < len(ids):
+                result["LimitedBy"] = offset + limit
+            return result
+
+        key = RESULT_DICTIONARY_KEYS_OF_API_METHODS.get(method)
+        if not isinstance(key, str):
+            return {}
+        objects = next((v for v in params.values() if isinstance(v, list)), [])
+        if not objects:
+            objects = params.get("SelectionCriteria", {}).get("Ids", [])
+        return {key: [{"Id": i + 1} for i in range(len(objects))]}
+
+    def _handle_report(
+        self, login: str, headers, body: dict
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        params = body.get("params", {})
+        name = params.get("ReportName", "")
+        retry_headers = {"retryIn": str(self.retry_in)}
+
+        if headers.get("processingMode") != "online":
+            now = time.monotonic()
+            with self._lock:
+                queue = self._reports[login]
+                if name not in queue:
+                    if len(queue) >= self.max_reports_in_queue:
+                        return 400, {}, orjson.dumps(self._error(9000))
+                    queue[name] = now + self.report_delay
+                    return 201, retry_headers, b""
+                elif queue[name] > now:
+                    return 202, retry_headers, b""
+                del queue[name]
+
+        return 200, {}, self._create_report(headers, params)
+
+    def _create_report(self, headers, params: dict) -> bytes:
+        field_names = params.get("FieldNames", ["Date"])
+        criteria = params.get("SelectionCriteria", {})
+        date = criteria.get("DateFrom", str(dt.date.today()))
+        money_in_micros = headers.get("returnMoneyInMicros") == "true"
+        types = [
+            report_fields.get_field_type(field, money_in_micros)
+            for field in field_names
+        ]
+
+        lines = []
+        if headers.get("skipReportHeader") == "false":
+            lines.append(
+                '"{} ({} - {})"'.format(
+                    params.get("ReportName", ""), date, criteria.get("DateTo", date)
+                )
+            )
+        if headers.get("skipColumnHeader") != "true":
+            lines.append("\t".join(field_names))
+        for i in range(self.report_rows):
+            values = []
+            for field, type_ in zip(field_names, types):
+                if type_ == "int":
+                    values.append(str(i))
+                elif type_ == "float":
+                    values.append("{:.2f}".format(i / 10))
+                elif type_ == "date":
+                    values.append(date)
+                else:
+                    values.append("{} {}".format(field, i))
+            lines.append("\t".join(values))
+        if headers.get("skipReportSummary") == "false":
+            lines.append("Total rows: {}".format(self.report_rows))
+
+        return ("\n".join(lines) + "\n").encode()
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    emulator = None  # type: ApiEmulator
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = orjson.loads(self.rfile.read(length)) if length else {}
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        resources = {"/" + r["resource"] for r in RESOURCE_MAPPING_V5.values()}
+        if path not in resources:
+            status, headers, content = 404, {}, b""
+        else:
+            status, headers, content = self.emulator.handle(path, self.headers, body)
+
+        self.send_response(status)
+        content_type = (
+            "text/tab-separated-values"
+            if status == 200 and path == REPORTS_PATH
+            else "application/json"
+        )
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local emulator of the Yandex Direct API"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--objects_count", type=int, default=1000)
+    parser.add_argument("--page_limit", type=int, default=10000)
+    parser.add_argument("--report_delay", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--report_rows", type=int, default=1000)
+    parser.add_argument(
+        "--error_rate",
+        nargs=2,
+        action="append",
+        metavar=("CODE", "RATE"),
+        default=[],
+        help="Probability of the error, for example --error_rate 52 0.01",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = ApiEmulator(
+        port=args.port,
+        latency=args.latency,
+        objects_count=args.objects_count,
+        page_limit=args.page_limit,
+        report_delay=args.report_delay,
+        report_rows=args.report_rows,
+        error_rates={int(code): float(rate) for code, rate in args.error_rate},
+    )
+    with emulator:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
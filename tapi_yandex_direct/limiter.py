@@ -0,0 +1,248 @@
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Spent units are restored within a day.
+UNITS_RESTORE_PERIOD = 60 * 60 * 24
+# Interval of checking the free slots of concurrent requests.
+SLOT_POLL_INTERVAL = 0.5
+# Deletes the lock only if it is still held by the token,
+# the lock of a process that ran longer than the lock timeout is taken by another.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def parse_units_header(value: str) -> Tuple[int, int, int]:
+    """Parses the Units header "spent/remaining/daily limit"."""
+    spent, remaining, limit = value.split("/")
+    return int(spent), int(remaining), int(limit)
+
+
+class MemoryLimiterBackend:
+    """State of the limiter in memory, is shared by the threads of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    @contextlib.contextmanager
+    def transaction(self, login: Optional[str]) -> Iterator[dict]:
+        """State of login, the changes of the state are saved on exit."""
+        with self._lock:
+            yield self._states.setdefault(login or "", {})
+
+
+class SqliteLimiterBackend:
+    """
+    State of the limiter in the sqlite database,
+    is shared by the processes of one node.
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: float = 30.0):
+        """
+        :param path: database file.
+        :param timeout: seconds to wait for the lock of the database.
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS limiter (login TEXT PRIMARY KEY, state BLOB)"
+        )
+
+    @contextlib.contextmanager
+    def transaction(self, login: Optional[str]) -> Iterator[dict]:
+        with self._lock:
+            # Locks the database for writing until the end of the transaction.
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT state FROM limiter WHERE login = ?", (login or "",)
+                ).fetchone()
+                state = {} if row is None else orjson.loads(row[0])
+                yield state
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO limiter VALUES (?, ?)",
+                    (login or "", orjson.dumps(state)),
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            else:
+                self._connection.execute("COMMIT")
+
+
+class RedisLimiterBackend:
+    """
+    State of the limiter in Redis, is shared by the processes of several nodes.
+
+        import redis
+        backend = RedisLimiterBackend(redis.Redis(host="localhost"))
+
+    Only the get, set and eval commands are used.
+    """
+
+    def __init__(
+        self,
+        client,
+        prefix: str = "tapi_yandex_direct:limiter:",
+        lock_timeout: float = 10.0,
+    ):
+        """
+        :param client: redis.Redis client.
+        :param prefix: prefix of the keys.
+        :param lock_timeout: seconds after which the lock of a crashed process expires.
+        """
+        self.client = client
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+
+    @contextlib.contextmanager
+    def transaction(self, login: Optional[str]) -> Iterator[dict]:
+        key = self.prefix + (login or "")
+        lock_key = key + ":lock"
+        token = uuid.uuid4().hex
+        while not self.client.set(
+            lock_key, token, nx=True, px=int(self.lock_timeout * 1000)
+        ):
+            time.sleep(0.01)
+
+        try:
+            value = self.client.get(key)
+            state = {} if value is None else orjson.loads(value)
+            yield state
+            self.client.set(key, orjson.dumps(state))
+        finally:
+            self.client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+
+class UnitsLimiter:
+    """
+    Token bucket of the units of each login.
+
+    The remaining units are taken from the Units header of the responses,
+    between responses the units are restored evenly within a day.
+    Before the request, its expected cost is reserved
+    and if there are not enough units, the request is paused until they are restored.
+    One limiter can be passed to the clients of several logins.
+
+    The state is stored in the backend, to share it between processes
+    pass SqliteLimiterBackend (one node) or RedisLimiterBackend (several nodes)
+    to the limiters of all processes.
+    """
+
+    def __init__(
+        self,
+        reserve: int = 0,
+        backend=None,
+        max_concurrent_requests: Optional[int] = None,
+        request_timeout: float = 60 * 10,
+    ):
+        """
+        :param reserve: number of units of each login that the limiter does not spend.
+        :param backend: MemoryLimiterBackend (by default), SqliteLimiterBackend
+            or RedisLimiterBackend.
+        :param max_concurrent_requests: maximum number of requests of each login
+            in flight, by default unlimited.
+        :param request_timeout: seconds after which the slot of a request
+            of a crashed process is released.
+        """
+        self.reserve = reserve
+        self.backend = backend or MemoryLimiterBackend()
+        self.max_concurrent_requests = max_concurrent_requests
+        self.request_timeout = request_timeout
+
+    def _restore(self, state: dict, now: float) -> None:
+        if "limit" in state:
+            restored = (now - state["time"]) * state["limit"] / UNITS_RESTORE_PERIOD
+            state["units"] = min(state["limit"], state["units"] + restored)
+            state["time"] = now
+
+    def _get_delay(self, state: dict) -> float:
+        if "limit" not in state:
+            return 0.0
+
+        shortage = state["cost"] + self.reserve - state["units"]
+        if shortage <= 0 or not state["limit"]:
+            return 0.0
+        return shortage * UNITS_RESTORE_PERIOD / state["limit"]
+
+    def update(self, login: Optional[str], units_header: Optional[str]) -> None:
+        """Updates the units of login by the Units header of the response."""
+        if not units_header:
+            return
+
+        spent, remaining, limit = parse_units_header(units_header)
+        with self.backend.transaction(login) as state:
+            if "cost" not in state:
+                state["cost"] = spent
+            else:
+                # Moving average of the cost of requests.
+                state["cost"] = (state["cost"] + spent) / 2
+            state.update(units=remaining, limit=limit, time=time.time())
+
+    def remaining(self, login: Optional[str]) -> Optional[float]:
+        with self.backend.transaction(login) as state:
+            self._restore(state, time.time())
+            return state.get("units")
+
+    def get_delay(self, login: Optional[str]) -> float:
+        """Seconds until the units for the next request of login are restored."""
+        with self.backend.transaction(login) as state:
+            self._restore(state, time.time())
+            return self._get_delay(state)
+
+    def acquire(self, login: Optional[str], units: bool = True) -> Optional[float]:
+        """
+        Reserves the units and the slot of a concurrent request for the next request of login.
+
+        :param units: reserve the units, requests that do not spend units
+            (reports) only take the slot.
+        :return: seconds to wait before sending the request,
+            None if all slots are busy, then call it again after SLOT_POLL_INTERVAL.
+        """
+        now = time.time()
+        with self.backend.transaction(login) as state:
+            self._restore(state, now)
+
+            if self.max_concurrent_requests is not None:
+                slots = [expires for expires in state.get("slots", []) if expires > now]
+                if len(slots) >= self.max_concurrent_requests:
+                    state["slots"] = slots
+                    return None
+
+            delay = self._get_delay(state) if units else 0.0
+            if units and "limit" in state:
+                state["units"] -= state["cost"]
+            if self.max_concurrent_requests is not None:
+                state["slots"] = slots + [now + delay + self.request_timeout]
+
+        if delay:
+            logger.warning(
+                "Not enough units of login '{}', "
+                "the request is paused for {:.0f} seconds".format(login, delay)
+            )
+        return delay
+
+    def release(self, login: Optional[str]) -> None:
+        """Releases the slot of the request of login after the response or the failure."""
+        if self.max_concurrent_requests is None:
+            return
+
+        with self.backend.transaction(login) as state:
+            slots = sorted(state.get("slots", []))
+            state["slots"] = slots[1:]
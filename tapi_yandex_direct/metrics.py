@@ -0,0 +1,83 @@
+from typing import Callable, Dict, Tuple
+
+# Name: (type, description, labels besides login and resource).
+METRICS = {
+    "request_seconds": ("histogram", "Time of the request until the response", ()),
+    "response_bytes": ("counter", "Size of the responses", ()),
+    "rows": ("counter", "Objects and report rows received", ()),
+    "units_spent": ("counter", "Units spent by the requests", ()),
+    "units_remaining": ("gauge", "Remaining units of the login", ()),
+    "retries": ("counter", "Retries of the requests", ("code",)),
+    "retry_sleep_seconds": ("counter", "Waiting before the retries", ("code",)),
+    "errors": ("counter", "Errors raised to the caller", ("code",)),
+    "report_wait_seconds": ("counter", "Waiting for the offline reports", ()),
+}
+LABELS = ("login", "resource")
+
+
+class CallbackMetrics:
+    """
+    Passes each measurement to the function.
+
+        def callback(name, value, labels):
+            print(name, value, labels)
+            # request_seconds 0.35 {'login': 'my-login', 'resource': 'campaigns'}
+
+        client = YandexDirect(access_token=ACCESS_TOKEN, metrics=CallbackMetrics(callback))
+    """
+
+    def __init__(self, callback: Callable[[str, float, Dict[str, str]], None]):
+        self.callback = callback
+
+    def record(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        self.callback(name, value, labels)
+
+
+class PrometheusMetrics:
+    """
+    Metrics of prometheus_client, requires 'pip install prometheus-client'.
+
+        client = YandexDirect(access_token=ACCESS_TOKEN, metrics=PrometheusMetrics())
+        prometheus_client.start_http_server(8000)
+    """
+
+    def __init__(
+        self,
+        registry=None,
+        namespace: str = "yandex_direct",
+        buckets: Tuple[float, ...] = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+    ):
+        """
+        :param registry: prometheus_client registry, by default the global one.
+        :param namespace: prefix of the metric names.
+        :param buckets: buckets of the request_seconds histogram.
+        """
+        import prometheus_client
+
+        registry = registry or prometheus_client.REGISTRY
+        self._metrics = {}
+        for name, (type_, description, labels) in METRICS.items():
+            kwargs = dict(
+                namespace=namespace,
+                labelnames=LABELS + labels,
+                registry=registry,
+            )
+            if type_ == "histogram":
+                metric = prometheus_client.Histogram(
+                    name, description, buckets=buckets, **kwargs
+                )
+            elif type_ == "counter":
+                metric = prometheus_client.Counter(name, description, **kwargs)
+            else:
+                metric = prometheus_client.Gauge(name, description, **kwargs)
+            self._metrics[name] = metric
+
+    def record(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        metric = self._metrics[name].labels(**labels)
+        type_ = METRICS[name][0]
+        if type_ == "histogram":
+            metric.observe(value)
+        elif type_ == "counter":
+            metric.inc(value)
+        else:
+            metric.set(value)
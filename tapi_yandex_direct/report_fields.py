@@ -0,0 +1,68 @@
+# Types of the report fields, https://yandex.ru/dev/direct/doc/reports/fields-list.html
+# Fields not listed here are strings.
+INTEGER_FIELDS = {
+    "AdGroupId",
+    "AdId",
+    "AudienceTargetId",
+    "Bounces",
+    "CampaignId",
+    "Clicks",
+    "Conversions",
+    "CriteriaId",
+    "CriterionId",
+    "DynamicTextAdTargetId",
+    "ImpressionReach",
+    "Impressions",
+    "LocationOfPresenceId",
+    "RlAdjustmentId",
+    "Sessions",
+    "SmartAdTargetId",
+    "SmartBannerFilterId",
+    "TargetingLocationId",
+}
+# Integers in micros if the returnMoneyInMicros header is true, otherwise decimals.
+MONEY_FIELDS = {
+    "AvgCpc",
+    "AvgCpm",
+    "AvgEffectiveBid",
+    "Cost",
+    "CostPerConversion",
+    "Profit",
+    "Revenue",
+}
+FLOAT_FIELDS = {
+    "AvgClickPosition",
+    "AvgImpressionFrequency",
+    "AvgImpressionPosition",
+    "AvgPageviews",
+    "AvgTrafficVolume",
+    "BounceRate",
+    "ConversionRate",
+    "Ctr",
+    "GoalsRoi",
+    "ImpressionShare",
+    "WeightedCtr",
+    "WeightedImpressions",
+}
+DATE_FIELDS = {
+    "Date",
+    "Month",
+    "Quarter",
+    "Week",
+    "Year",
+}
+# Value of the field if there is no data.
+NULL_VALUE = "--"
+
+
+def get_field_type(field: str, money_in_micros: bool) -> str:
+    """Returns one of: int, float, date, str."""
+    if field in INTEGER_FIELDS:
+        return "int"
+    elif field in MONEY_FIELDS:
+        return "int" if money_in_micros else "float"
+    elif field in FLOAT_FIELDS:
+        return "float"
+    elif field in DATE_FIELDS:
+        return "date"
+    return "str"
@@ -0,0 +1,301 @@
+import asyncio
+import datetime as dt
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from tapi2.tapi import TapiClient
+
+from tapi_yandex_direct import exceptions
+from tapi_yandex_direct.async_client import AsyncYandexDirect
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of reports of one advertiser in the offline queue of the server.
+MAX_OFFLINE_REPORTS_PER_LOGIN = 5
+
+
+async def fetch_reports(
+    client: AsyncYandexDirect,
+    jobs: Iterable[Tuple[Optional[str], dict]],
+    *,
+    max_reports_per_login: int = MAX_OFFLINE_REPORTS_PER_LOGIN,
+    return_exceptions: bool = False
+) -> List[TapiClient]:
+    """
+    Requests reports of many logins concurrently and waits for all of them.
+
+    Reports of one login are not requested more than max_reports_per_login at a time,
+    so as not to overflow the offline queue of the server (error 9000).
+    All pending reports are polled simultaneously,
+    so the total time is limited by the slowest report.
+
+    :param client: the parameters and connection pool of this client are used for all logins.
+    :param jobs: pairs (login, report request body).
+    :param max_reports_per_login: number of reports of one login in the offline queue.
+    :param return_exceptions: return exceptions in the result instead of raising them.
+    :return: reports in the order of jobs.
+    """
+    jobs = list(jobs)
+    clients = {}
+    semaphores = {}
+    for login, _ in jobs:
+        if login not in clients:
+            clients[login] = client.for_login(login)
+            clients[login].api_params["wait_report"] = True
+            semaphores[login] = asyncio.Semaphore(max_reports_per_login)
+
+    async def fetch(login: Optional[str], body: dict) -> TapiClient:
+        async with semaphores[login]:
+            logger.info("Request report of login '{}'".format(login))
+            return await clients[login].reports().post(data=body)
+
+    return await asyncio.gather(
+        *(fetch(login, body) for login, body in jobs),
+        return_exceptions=return_exceptions
+    )
+
+
+def split_date_range(date_from: str, date_to: str, days: int) -> List[Tuple[str, str]]:
+    """Splits the period into periods of no more than days, the dates are inclusive."""
+    start = dt.date.fromisoformat(date_from)
+    end = dt.date.fromisoformat(date_to)
+    ranges = []
+    while start <= end:
+        stop = min(start + dt.timedelta(days=days - 1), end)
+        ranges.append((str(start), str(stop)))
+        start = stop + dt.timedelta(days=1)
+    return ranges
+
+
+def halve_date_range(date_from: str, date_to: str) -> List[Tuple[str, str]]:
+    days = (dt.date.fromisoformat(date_to) - dt.date.fromisoformat(date_from)).days + 1
+    return split_date_range(date_from, date_to, (days + 1) // 2)
+
+
+def fetch_report_by_date_ranges(
+    client: TapiClient,
+    data: dict,
+    *,
+    days: int = None,
+    workers: int = 4,
+    min_days: int = 1
+) -> Iterator[str]:
+    """
+    Requests the report in parts by periods and merges them.
+
+    The period of the report is split into periods of no more than days,
+    the parts are requested concurrently as separate reports.
+    If the generation time of a part exceeds the server limit (502 error),
+    its period is halved and the halves are requested again.
+    Use it with processing_mode="offline" and wait_report=True.
+
+        lines = fetch_report_by_date_ranges(client, body, days=31)
+        columns = next(lines).split("\\t")
+        for line in lines:
+            ...
+
+    :param client: client of the login of the report.
+    :param data: report request body with DateRangeType CUSTOM_DATE.
+    :param days: size of the parts, by default the report is requested entirely
+        and is split only on the 502 error.
+    :param workers: number of reports in the queue at the same time.
+    :param min_days: parts of this number of days are not split.
+    :return: lines of the report parts in the order of periods,
+        the line of columns is the first and only once.
+    """
+    params = data["params"]
+    if params.get("DateRangeType") != "CUSTOM_DATE":
+        raise ValueError("Only the period with DateRangeType CUSTOM_DATE can be split")
+
+    criteria = params["SelectionCriteria"]
+    date_range = (criteria["DateFrom"], criteria["DateTo"])
+    if days:
+        ranges = split_date_range(*date_range, days)
+    else:
+        ranges = [date_range]
+
+    def fetch(date_from: str, date_to: str) -> TapiClient:
+        # Reports in the queue must have different names.
+        name = "{} {}_{}".format(params.get("ReportName", "report"), date_from, date_to)
+        body = {
+            **data,
+            "params": {
+                **params,
+                "ReportName": name,
+                "SelectionCriteria": {
+                    **criteria,
+                    "DateFrom": date_from,
+                    "DateTo": date_to,
+                },
+            },
+        }
+        logger.info("Request report part {} - {}".format(date_from, date_to))
+        return client.reports().post(data=body)
+
+    reports = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, *date_range): date_range for date_range in ranges}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                date_range = futures.pop(future)
+                try:
+                    reports[date_range] = future.result()
+                except exceptions.YandexDirectApiError as exc:
+                    date_from, date_to = map(dt.date.fromisoformat, date_range)
+                    if (
+                        exc.response.status_code != 502
+                        or (date_to - date_from).days + 1 <= min_days
+                    ):
+                        raise
+
+                    logger.warning(
+                        "Report part {} - {} is too big, it is split in half".format(
+                            *date_range
+                        )
+                    )
+                    for half in halve_date_range(*date_range):
+                        futures[pool.submit(fetch, *half)] = half
+
+    return iter_merged_lines([reports[date_range] for date_range in sorted(reports)])
+
+
+def iter_merged_lines(reports: List[TapiClient]) -> Iterator[str]:
+    """
+    Lines of the reports with the same columns, the line of columns is the first.
+    There are no lines without reports.
+    """
+    if not reports:
+        return
+
+    yield "\t".join(reports[0].columns)
+    for report in reports:
+        yield from report().iter_lines()
+
+
+class ReportScheduler:
+    """
+    Waits for the offline reports in the background.
+
+    submit() sends the report request and returns a future immediately.
+    One thread polls all pending reports, each at the time of its retryIn header,
+    the requests are sent by the pool of workers.
+
+        with ReportScheduler(workers=8) as scheduler:
+            futures = [scheduler.submit(client, body) for body in bodies]
+            for future in as_completed(futures):
+                print(future.result()().to_dicts())
+    """
+
+    def __init__(self, workers: int = 4):
+        """:param workers: number of requests in flight."""
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._condition = threading.Condition()
+        # Heap of (poll time, number, client, request body, future).
+        self._queue = []
+        self._counter = itertools.count()
+        self._in_flight = 0
+        self._closed = False
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, client: TapiClient, data: dict) -> Future:
+        """
+        :param client: client of the login of the report.
+        :param data: report request body.
+        :return: future of the ready report.
+        """
+        if self._closed:
+            raise RuntimeError("Scheduler is closed")
+
+        # The scheduler waits for the report instead of the client.
+        client = TapiClient(
+            client._api,
+            api_params={**client._api_params, "wait_report": False},
+            session=client._session,
+        )
+        future = Future()
+        self._schedule(0, client, data, future)
+        return future
+
+    def _schedule(
+        self, delay: float, client: TapiClient, data: dict, future: Future
+    ) -> None:
+        with self._condition:
+            if self._cancelled:
+                future.cancel()
+                return
+            heapq.heappush(
+                self._queue,
+                (time.monotonic() + delay, next(self._counter), client, data, future),
+            )
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not self._queue and not self._in_flight:
+                        return
+
+                    timeout = None
+                    if self._queue:
+                        timeout = self._queue[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+
+                _, _, client, data, future = heapq.heappop(self._queue)
+                if future.cancelled():
+                    continue
+                self._in_flight += 1
+
+            self._pool.submit(self._poll, client, data, future)
+
+    def _poll(self, client: TapiClient, data: dict, future: Future) -> None:
+        try:
+            report = client.reports().post(data=data)
+        except Exception as exc:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(exc)
+        else:
+            if report.status_code in (201, 202):
+                delay = int(report.response.headers.get("retryIn", 10))
+                logger.info(
+                    "Report not ready, re-request after {} seconds".format(delay)
+                )
+                self._schedule(delay, client, data, future)
+            elif future.set_running_or_notify_cancel():
+                future.set_result(report)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def close(self, wait: bool = True) -> None:
+        """
+        :param wait: wait for the pending reports, otherwise they are cancelled.
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                self._cancelled = True
+                for item in self._queue:
+                    item[-1].cancel()
+                self._queue.clear()
+            self._condition.notify()
+
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "ReportScheduler":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,88 @@
+import random
+from typing import Dict, Optional
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    The wait before the n-th retry is a random number
+    from 0 to min(max_delay, base_delay * 2 ** (n - 1)),
+    so the workers that hit a limit together do not retry together.
+    The wait suggested by the server (Retry-After, units limiter) is used as is.
+
+        policy = RetryPolicy(
+            base_delay=1,
+            max_delay=60,
+            max_elapsed_time=600,
+            overrides={9000: RetryPolicy(base_delay=30, max_delay=300)},
+        )
+        client = YandexDirect(access_token=ACCESS_TOKEN, retry_policy=policy)
+    """
+
+    def __init__(
+        self,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        max_retries: Optional[int] = None,
+        max_elapsed_time: Optional[float] = None,
+        jitter: bool = True,
+        overrides: Dict[int, "RetryPolicy"] = None,
+    ):
+        """
+        :param base_delay: wait before the first retry in seconds.
+        :param max_delay: maximum wait before a retry in seconds.
+        :param max_retries: maximum number of retries, by default unlimited.
+        :param max_elapsed_time: after this number of seconds since the first error
+            the request is not retried, by default unlimited.
+        :param jitter: wait a random time from 0 to the backoff.
+        :param overrides: policies by API error code or HTTP status code,
+            the codes not given here keep the policies of DEFAULT_OVERRIDES.
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.max_elapsed_time = max_elapsed_time
+        self.jitter = jitter
+        self.overrides = overrides or {}
+
+    def get_policy(self, code: int) -> "RetryPolicy":
+        if code in self.overrides:
+            return self.overrides[code]
+        return DEFAULT_OVERRIDES.get(code, self)
+
+    def get_delay(
+        self, repeat_number: int, elapsed: float = 0.0, hint: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        :param repeat_number: number of the retry, starting from 1.
+        :param elapsed: seconds since the first error.
+        :param hint: wait suggested by the server.
+        :return: seconds to wait before the retry, None if not to retry.
+        """
+        if self.max_retries is not None and repeat_number > self.max_retries:
+            return None
+
+        if hint is not None:
+            delay = hint
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** (repeat_number - 1))
+            if self.jitter:
+                delay = random.uniform(0, delay)
+
+        if (
+            self.max_elapsed_time is not None
+            and elapsed + delay > self.max_elapsed_time
+        ):
+            return None
+        return delay
+
+
+DEFAULT_OVERRIDES = {
+    # Units are restored within a day.
+    152: RetryPolicy(base_delay=60 * 5, max_delay=60 * 5, jitter=False),
+    56: RetryPolicy(base_delay=10, max_delay=60 * 2),
+    506: RetryPolicy(base_delay=10, max_delay=60 * 2),
+    9000: RetryPolicy(base_delay=10, max_delay=60 * 5),
+}
+DEFAULT_RETRY_POLICY = RetryPolicy()
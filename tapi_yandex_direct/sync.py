@@ -0,0 +1,284 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import orjson
+from tapi2.tapi import TapiClient
+
+from tapi_yandex_direct.batch import post_batches
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIELD_NAMES = {
+    "campaigns": ["Id", "Name", "Type", "State", "Status"],
+    "adgroups": ["Id", "Name", "CampaignId", "Type", "Status"],
+    "ads": ["Id", "AdGroupId", "CampaignId", "Type", "State", "Status"],
+}
+# Maximum number of campaigns in the check method.
+CHECK_CAMPAIGN_IDS_LIMIT = 3000
+
+
+class SqliteSnapshot:
+    """
+    Local copy of the campaigns, ad groups and ads of logins in the sqlite database.
+
+    Objects are stored as JSON, the time of the last sync is stored for each login.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """:param path: database file."""
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects (login TEXT, entity TEXT, "
+                "id INTEGER, campaign_id INTEGER, data BLOB, "
+                "PRIMARY KEY (login, entity, id))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS timestamps "
+                "(login TEXT PRIMARY KEY, timestamp TEXT)"
+            )
+
+    def get_timestamp(self, login: Optional[str]) -> Optional[str]:
+        """Server time of the last sync of login."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT timestamp FROM timestamps WHERE login = ?", (login or "",)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, login: Optional[str], entity: str) -> List[dict]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT data FROM objects WHERE login = ? AND entity = ? ORDER BY id",
+                (login or "", entity),
+            ).fetchall()
+        return [orjson.loads(data) for data, in rows]
+
+    def merge(
+        self,
+        login: Optional[str],
+        timestamp: str,
+        objects: Dict[str, List[dict]],
+        deleted: Dict[str, Iterable[int]] = None,
+        replaced_campaign_ids: Iterable[int] = (),
+    ) -> None:
+        """
+        Applies the changes of login in one transaction.
+
+        :param timestamp: server time of the sync.
+        :param objects: new and modified objects by entity.
+        :param deleted: IDs of deleted objects by entity,
+            ad groups and ads of the deleted campaigns are deleted too.
+        :param replaced_campaign_ids: campaigns whose ad groups and ads
+            are replaced entirely by the passed objects.
+        """
+        login = login or ""
+        deleted = deleted or {}
+        with self._lock, self._connection:
+            for campaign_id in replaced_campaign_ids:
+                self._connection.execute(
+                    "DELETE FROM objects WHERE login = ? AND entity != 'campaigns' "
+                    "AND campaign_id = ?",
+                    (login, campaign_id),
+                )
+            for campaign_id in deleted.get("campaigns", ()):
+                self._connection.execute(
+                    "DELETE FROM objects WHERE login = ? AND campaign_id = ?",
+                    (login, campaign_id),
+                )
+            for entity, ids in deleted.items():
+                self._connection.executemany(
+                    "DELETE FROM objects WHERE login = ? AND entity = ? AND id = ?",
+                    [(login, entity, id_) for id_ in ids],
+                )
+            for entity, items in objects.items():
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            login,
+                            entity,
+                            item["Id"],
+                            item["Id"] if entity == "campaigns" else item["CampaignId"],
+                            orjson.dumps(item),
+                        )
+                        for item in items
+                    ],
+                )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO timestamps VALUES (?, ?)", (login, timestamp)
+            )
+
+
+class IncrementalSync:
+    """
+    Keeps the snapshot of campaigns, ad groups and ads up to date
+    with the changes resource.
+
+    The first sync downloads all objects of the login.
+    The next syncs find the modified objects with the checkCampaigns and check methods
+    since the last sync and download only them.
+
+        sync = IncrementalSync(SqliteSnapshot("structure.db"))
+        for login in logins:
+            client = YandexDirect(access_token=ACCESS_TOKEN, login=login, session=session)
+            sync.sync(client)
+    """
+
+    def __init__(
+        self,
+        snapshot: SqliteSnapshot,
+        field_names: Dict[str, List[str]] = None,
+        workers: int = 4,
+    ):
+        """
+        :param snapshot: storage of the objects.
+        :param field_names: FieldNames of campaigns, adgroups and ads,
+            Id and CampaignId are required.
+        :param workers: number of requests in flight.
+        """
+        self.snapshot = snapshot
+        self.field_names = {**DEFAULT_FIELD_NAMES, **(field_names or {})}
+        self.workers = workers
+
+    def _post(self, client: TapiClient, resource: str, data: dict) -> dict:
+        return getattr(client, resource)().post(data=data).data["result"]
+
+    def _get_objects(
+        self, client: TapiClient, entity: str, criteria_key: str, ids: List[int]
+    ) -> List[dict]:
+        """Downloads all pages of objects, IDs are split into batches by the API limits."""
+        if not ids:
+            return []
+
+        data = {
+            "method": "get",
+            "params": {
+                "SelectionCriteria": {criteria_key: ids},
+                "FieldNames": self.field_names[entity],
+            },
+        }
+        return post_batches(getattr(client, entity)(), data, workers=self.workers)
+
+    def _get_children(
+        self, client: TapiClient, campaign_ids: List[int]
+    ) -> Dict[str, List[dict]]:
+        return {
+            entity: self._get_objects(client, entity, "CampaignIds", campaign_ids)
+            for entity in ("adgroups", "ads")
+        }
+
+    def _full_sync(self, client: TapiClient, login: Optional[str]) -> Dict[str, int]:
+        # The time is taken before downloading, so the changes made during
+        # the download will be found by the next sync.
+        timestamp = self._post(client, "changes", {"method": "checkDictionaries"})[
+            "Timestamp"
+        ]
+        campaigns = list(
+            client.campaigns()
+            .post(
+                data={
+                    "method": "get",
+                    "params": {
+                        "SelectionCriteria": {},
+                        "FieldNames": self.field_names["campaigns"],
+                    },
+                }
+            )()
+            .iter_items()
+        )
+        campaign_ids = [campaign["Id"] for campaign in campaigns]
+        objects = {"campaigns": campaigns, **self._get_children(client, campaign_ids)}
+
+        self.snapshot.merge(
+            login, timestamp, objects, replaced_campaign_ids=campaign_ids
+        )
+        return {entity: len(items) for entity, items in objects.items()}
+
+    def _incremental_sync(
+        self, client: TapiClient, login: Optional[str], timestamp: str
+    ) -> Dict[str, int]:
+        result = self._post(
+            client,
+            "changes",
+            {"method": "checkCampaigns", "params": {"Timestamp": timestamp}},
+        )
+        new_timestamp = result["Timestamp"]
+        changed = result.get("Campaigns", [])
+        self_ids = [c["CampaignId"] for c in changed if "SELF" in c["ChangesIn"]]
+        children_ids = [
+            c["CampaignId"] for c in changed if "CHILDREN" in c["ChangesIn"]
+        ]
+
+        modified = {"campaigns": self_ids, "adgroups": [], "ads": []}
+        deleted_campaign_ids = []
+        unprocessed_ids = []
+        for i in range(0, len(children_ids), CHECK_CAMPAIGN_IDS_LIMIT):
+            result = self._post(
+                client,
+                "changes",
+                {
+                    "method": "check",
+                    "params": {
+                        "CampaignIds": children_ids[i : i + CHECK_CAMPAIGN_IDS_LIMIT],
+                        "FieldNames": ["AdGroupIds", "AdIds"],
+                        "Timestamp": timestamp,
+                    },
+                },
+            )
+            modified["adgroups"] += result.get("Modified", {}).get("AdGroupIds", [])
+            modified["ads"] += result.get("Modified", {}).get("AdIds", [])
+            deleted_campaign_ids += result.get("NotFound", {}).get("CampaignIds", [])
+            unprocessed_ids += result.get("Unprocessed", {}).get("CampaignIds", [])
+
+        objects = {}
+        deleted = {}
+        for entity, ids in modified.items():
+            objects[entity] = self._get_objects(client, entity, "Ids", ids)
+            # Objects that were not returned have been deleted.
+            found_ids = {item["Id"] for item in objects[entity]}
+            deleted[entity] = [id_ for id_ in ids if id_ not in found_ids]
+        deleted["campaigns"] += deleted_campaign_ids
+
+        if unprocessed_ids:
+            logger.info(
+                "The changes of {} campaigns are not processed, "
+                "their ad groups and ads are downloaded entirely".format(
+                    len(unprocessed_ids)
+                )
+            )
+            for entity, items in self._get_children(client, unprocessed_ids).items():
+                objects[entity] += items
+
+        self.snapshot.merge(
+            login,
+            new_timestamp,
+            objects,
+            deleted,
+            replaced_campaign_ids=unprocessed_ids,
+        )
+        stats = {entity: len(items) for entity, items in objects.items()}
+        stats["deleted"] = sum(len(ids) for ids in deleted.values())
+        return stats
+
+    def sync(self, client: TapiClient) -> Dict[str, int]:
+        """
+        Syncs the objects of the login of the client.
+
+        :return: number of downloaded objects by entity and number of deleted objects.
+        """
+        login = client._api_params.get("login")
+        timestamp = self.snapshot.get_timestamp(login)
+        if timestamp is None:
+            logger.info("Full sync of login '{}'".format(login))
+            stats = self._full_sync(client, login)
+        else:
+            logger.info("Sync of login '{}' since {}".format(login, timestamp))
+            stats = self._incremental_sync(client, login, timestamp)
+
+        logger.info("Login '{}' is synced: {}".format(login, stats))
+        return stats
@@ -1,18 +1,35 @@
+import codecs
+import collections
+import contextlib
+import copy
+import csv
+import functools
 import io
+import itertools
 import logging
+import operator
 import time
-from typing import Union, Optional, Dict, List, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union, Optional, Dict, List, Iterator, Tuple
 
 import orjson
-from requests import Response
-from tapi2 import TapiAdapter, generate_wrapper_from_adapter, JSONAdapterMixin
+from requests import PreparedRequest, Response, Session
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from tapi2 import TapiAdapter, JSONAdapterMixin
 from tapi2.exceptions import ResponseProcessException, ClientError, TapiException
+from tapi2.tapi import TapiClient, TapiClientExecutor, TapiInstantiator
 
-from tapi_yandex_direct import exceptions
+from tapi_yandex_direct import cache, exceptions, limiter, report_fields, retry
 from tapi_yandex_direct.resource_mapping import RESOURCE_MAPPING_V5
 
 logger = logging.getLogger(__name__)
 
+LIMIT_ERROR_MESSAGES = {
+    56: "Method request limit exceeded",
+    506: "API requests exceeded",
+    9000: "Created by max number of reports",
+}
 RESULT_DICTIONARY_KEYS_OF_API_METHODS = {
     "add": "AddResults",
     "update": "UpdateResults",
@@ -57,17 +74,199 @@ RESULT_DICTIONARY_KEYS_OF_API_METHODS = {
     },
 }
 REPORTS_RESOURCE_URL = "/json/v5/reports"
+REPORT_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class ReportStream:
+    """
+    Lines of the body of a streaming report, incrementally decoded.
+
+    The line of columns is read on creation,
+    the rest of the body can be read without decoding by iter_chunks.
+    """
+
+    def __init__(self, response: Response, chunk_size: int = REPORT_STREAM_CHUNK_SIZE):
+        self.response = response
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+        head = b""
+        while b"\n" not in head:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            head += chunk
+        columns, _, self._head = head.partition(b"\n")
+        self.columns = columns.decode()
+        self._lines = None
+
+    def __iter__(self) -> "ReportStream":
+        return self
+
+    def __next__(self) -> str:
+        if self._lines is None:
+            self._lines = itertools.chain((self.columns,), self._iter_lines())
+        return next(self._lines)
+
+    def _iter_lines(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        tail = ""
+        for chunk in self._iter_body():
+            lines = (tail + decoder.decode(chunk)).split("\n")
+            tail = lines.pop()
+            yield from lines
+
+        tail += decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Body after the line of columns, if its lines are not read yet."""
+        if self._lines is not None:
+            raise ValueError("The lines of the report are already read")
+        self._lines = iter(())
+        return self._iter_body()
+
+    def _iter_body(self) -> Iterator[bytes]:
+        try:
+            if self._head:
+                yield self._head
+            yield from self._chunks
+        finally:
+            self.response.close()
+
+
+def get_request_delay(api_params: dict, url: str) -> Optional[float]:
+    """
+    Reserves the units and the slot of the request in the units limiter of the client.
+
+    :return: seconds to wait before the request, None if the limiter must be asked again.
+    """
+    units_limiter = api_params.get("units_limiter")
+    if units_limiter is None:
+        return 0.0
+    # Reports do not spend units and their responses have no Units header.
+    return units_limiter.acquire(
+        api_params.get("login"), units=not url.endswith(REPORTS_RESOURCE_URL)
+    )
+
+
+def release_request(api_params: dict) -> None:
+    """Releases the slot of the request, whether the response is received or not."""
+    units_limiter = api_params.get("units_limiter")
+    if units_limiter is not None:
+        units_limiter.release(api_params.get("login"))
+
+
+def iter_text_lines(text: str) -> Iterator[str]:
+    """Lines of the text without line breaks, the text is not copied."""
+    find = text.find
+    start = 0
+    while True:
+        end = find("\n", start)
+        if end == -1:
+            if start < len(text):
+                yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+@functools.lru_cache(maxsize=128)
+def create_record_class(columns: Tuple[str, ...]) -> type:
+    """
+    Row type of the report, a named tuple with access to values by column name.
+
+    Values are stored in a tuple, the column names are stored once in the class.
+    """
+    base = collections.namedtuple("ReportRecord", columns, rename=True)
+    indexes = {column: i for i, column in enumerate(columns)}
+
+    class ReportRecord(base):
+        __slots__ = ()
+
+        def __getitem__(self, item: Union[int, str, slice]):
+            if isinstance(item, str):
+                return tuple.__getitem__(self, indexes[item])
+            return tuple.__getitem__(self, item)
+
+        def get(self, key: str, default=None):
+            index = indexes.get(key)
+            return default if index is None else tuple.__getitem__(self, index)
+
+        def keys(self) -> Tuple[str, ...]:
+            return columns
+
+        def items(self) -> Iterator[Tuple[str, str]]:
+            return zip(columns, self)
+
+        def to_dict(self) -> dict:
+            return dict(zip(columns, self))
+
+    return ReportRecord
+
+
+class LinesReader(io.RawIOBase):
+    """Binary file object over the lines of the report, for reading by other libraries."""
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunks = [self._buffer]
+        size = len(self._buffer)
+        while size < len(buffer):
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunk = (line + "\n").encode()
+            chunks.append(chunk)
+            size += len(chunk)
+
+        data = b"".join(chunks)
+        size = min(len(buffer), len(data))
+        buffer[:size] = data[:size]
+        self._buffer = data[size:]
+        return size
+
+
+def traced(method):
+    """Traces the native method as a phase of the processing of the response."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._trace_phase(method.__name__, **kwargs) as span:
+            result = method(self, *args, **kwargs)
+            if span is not None and isinstance(result, list):
+                span.set_attribute("rows", len(result))
+        return result
+
+    return wrapper
+
+
+class RequestKwargs(dict):
+    """
+    Arguments of the request.
+
+    The attributes are passed from get_request_kwargs to process_response
+    with the request and are not sent.
+    """
+
+    # Request body before encoding, so as not to parse it again.
+    body = None
+    retry_policy = None
 
 
 class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
     resource_mapping = RESOURCE_MAPPING_V5
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
     def get_api_root(self, api_params: dict, resource_name: str) -> str:
         if resource_name == "debugtoken":
             return "https://"
+        elif api_params.get("api_root"):
+            return api_params["api_root"]
         elif api_params.get("is_sandbox"):
             return "https://api-sandbox.direct.yandex.com/"
         else:
@@ -75,7 +274,14 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
 
     def get_request_kwargs(self, api_params: dict, *args, **kwargs) -> dict:
         """Обогащение запроса, параметрами"""
-        params = super().get_request_kwargs(api_params, *args, **kwargs)
+        retry_policy = kwargs.pop("retry_policy", None)
+        body = self.serialize_data(kwargs.pop("data", None))
+        params = RequestKwargs(super().get_request_kwargs(api_params, *args, **kwargs))
+        params["data"] = self.format_data_to_request(body)
+        params.body = body
+        # Is not an argument of the request, it is returned to request_kwargs
+        # after the request is sent.
+        params.retry_policy = retry_policy
 
         token = api_params.get("access_token")
         if token:
@@ -107,6 +313,18 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
             api_params.get("skip_report_summary", True)
         ).lower()
 
+        if params["url"].endswith(REPORTS_RESOURCE_URL):
+            if api_params.get("stream_report"):
+                params["stream"] = True
+
+            if api_params.get("report_cache") is not None and body:
+                report_name = cache.create_report_name(body, params["headers"])
+                params.body = {
+                    **body,
+                    "params": {**body["params"], "ReportName": report_name},
+                }
+                params["data"] = self.format_data_to_request(params.body)
+
         if "receive_all_objects" in api_params:
             raise exceptions.BackwardCompatibilityError(
                 "parameter 'receive_all_objects'"
@@ -131,6 +349,14 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
         if data:
             return orjson.dumps(data)
 
+    def _get_request_body(self, request_kwargs: dict) -> Optional[dict]:
+        """Request body before encoding by format_data_to_request."""
+        if isinstance(request_kwargs, RequestKwargs):
+            return request_kwargs.body
+
+        encoded = request_kwargs.get("data")
+        return None if encoded is None else orjson.loads(encoded)
+
     def response_to_native(self, response: Response) -> Union[dict, str]:
         if response.content.strip():
             try:
@@ -141,8 +367,32 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
     def process_response(
         self, response: Response, request_kwargs: dict, **kwargs
     ) -> dict:
-        request_kwargs["data"] = orjson.loads(request_kwargs["data"])
+        request_kwargs["data"] = self._get_request_body(request_kwargs)
+        retry_policy = getattr(request_kwargs, "retry_policy", None)
+        if retry_policy is not None:
+            request_kwargs["retry_policy"] = retry_policy
+
+        units_limiter = kwargs["api_params"].get("units_limiter")
+        if units_limiter is not None:
+            # The slot of the request is released by the session after the send.
+            login = kwargs["api_params"].get("login")
+            units_limiter.update(login, response.headers.get("Units"))
+
+        self._record_response_metrics(response, request_kwargs, **kwargs)
+        self._trace_request(response, request_kwargs, **kwargs)
 
+        try:
+            return self._process_response(response, request_kwargs, **kwargs)
+        except ResponseProcessException:
+            # The trace is ended by retry_request or error_handling.
+            raise
+        except Exception:
+            self._end_trace(kwargs["store"], error=True)
+            raise
+
+    def _process_response(
+        self, response: Response, request_kwargs: dict, **kwargs
+    ) -> dict:
         if response.status_code == 502:
             raise exceptions.YandexDirectApiError(
                 response,
@@ -160,7 +410,31 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
                 **kwargs
             )
 
-        data = self.response_to_native(response)
+        if (
+            request_kwargs.get("stream")
+            and response.status_code == 200
+            and response.request.path_url == REPORTS_RESOURCE_URL
+        ):
+            stream = ReportStream(response)
+            kwargs["store"]["columns"] = stream.columns.split("\t")
+            self._end_trace(kwargs["store"])
+            return stream
+
+        if (
+            response.status_code == 200
+            and response.request.path_url == REPORTS_RESOURCE_URL
+        ):
+            with self._trace_phase("decode", **kwargs):
+                data = response.content.decode()
+            kwargs["store"]["columns"] = next(iter_text_lines(data), "").split("\t")
+            if kwargs["api_params"].get("metrics") is not None:
+                rows = data.count("\n") - 1 if data.endswith("\n") else data.count("\n")
+                self._record_metric("rows", max(rows, 0), **kwargs)
+            self._end_trace(kwargs["store"])
+            return data
+
+        with self._trace_phase("decode", **kwargs):
+            data = self.response_to_native(response)
 
         if isinstance(data, dict) and data.get("error"):
             raise ResponseProcessException(ClientError, data)
@@ -169,14 +443,181 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
         else:
             data = super().process_response(response, request_kwargs, **kwargs)
 
-        if response.request.path_url == REPORTS_RESOURCE_URL:
-            lines = self._iter_lines(data=data, response=response, **kwargs)
-            kwargs["store"]["columns"] = next(lines).split("\t")
-        else:
-            kwargs["store"].pop("columns", None)
+        kwargs["store"].pop("columns", None)
+
+        if (
+            kwargs["api_params"].get("metrics") is not None
+            and isinstance(request_kwargs["data"], dict)
+            and request_kwargs["data"].get("method") == "get"
+        ):
+            key = RESULT_DICTIONARY_KEYS_OF_API_METHODS["get"].get(
+                response.request.path_url
+            )
+            self._record_metric("rows", len(data["result"].get(key, [])), **kwargs)
 
+        self._end_trace(kwargs["store"])
         return data
 
+    def _trace_request(
+        self,
+        response: Response,
+        request_kwargs: dict,
+        api_params: dict,
+        store: dict,
+        resource_name: str = None,
+        **kwargs
+    ) -> None:
+        """
+        Spans of the attempt of the request: the wait for the units,
+        the wait for the response headers and the download of the response body.
+        The attempts of one call are nested in its span until the data is returned.
+        """
+        times = getattr(response, "request_times", None)
+        tracer = api_params.get("tracer")
+        if times is None or tracer is None:
+            return
+
+        pause_start, start = times
+        end = time.time_ns()
+        root = store.get("trace_span")
+        if root is None:
+            attributes = {"resource": resource_name or ""}
+            if api_params.get("login"):
+                attributes["login"] = api_params["login"]
+            data = request_kwargs["data"]
+            if isinstance(data, dict):
+                if data.get("method"):
+                    attributes["method"] = data["method"]
+                report_name = (data.get("params") or {}).get("ReportName")
+                if report_name:
+                    attributes["report_name"] = report_name
+            root = tracer.start_span(
+                "yandex_direct.{}".format(resource_name),
+                attributes=attributes,
+                start_time=pause_start,
+            )
+            # The span of the call is kept as the parent of the phases
+            # of the processing of the data after it is ended.
+            store.update(
+                trace_span=root,
+                trace_parent=root,
+                trace_attributes=attributes,
+                trace_attempt=0,
+            )
+
+        store["trace_attempt"] += 1
+        if start - pause_start > 10 ** 6:
+            tracer.start_span(
+                "yandex_direct.units_wait", parent=root, start_time=pause_start
+            ).end(end_time=start)
+
+        attempt = tracer.start_span(
+            "yandex_direct.request",
+            parent=root,
+            attributes={
+                "attempt": store["trace_attempt"],
+                "status_code": response.status_code,
+            },
+            start_time=start,
+        )
+        request_id = response.headers.get("RequestId")
+        if request_id:
+            attempt.set_attribute("request_id", request_id)
+            root.set_attribute("request_id", request_id)
+            store["trace_attributes"] = {
+                **store["trace_attributes"],
+                "request_id": request_id,
+            }
+
+        # Elapsed is the time until the headers of the response are received.
+        elapsed = int(response.elapsed.total_seconds() * 10 ** 9)
+        headers_time = min(start + elapsed, end)
+        tracer.start_span(
+            "yandex_direct.server_wait", parent=attempt, start_time=start
+        ).end(end_time=headers_time)
+        if not request_kwargs.get("stream"):
+            tracer.start_span(
+                "yandex_direct.download", parent=attempt, start_time=headers_time
+            ).end(end_time=end)
+        attempt.end(end_time=end)
+
+    def _end_trace(self, store: dict, **attributes) -> None:
+        root = store.pop("trace_span", None)
+        if root is not None:
+            for key, value in attributes.items():
+                root.set_attribute(key, value)
+            root.end()
+
+    @contextlib.contextmanager
+    def _trace_phase(
+        self, name: str, api_params: dict, store: dict = None, **kwargs
+    ) -> Iterator:
+        """
+        Span of the phase, nested in the span of the call that returned the data.
+
+        :return: span, None if the tracer is not set.
+        """
+        tracer = api_params.get("tracer")
+        if tracer is None:
+            yield None
+            return
+
+        store = store if store is not None else {}
+        span = tracer.start_span(
+            "yandex_direct.{}".format(name),
+            parent=store.get("trace_parent"),
+            attributes=store.get("trace_attributes"),
+        )
+        try:
+            yield span
+        finally:
+            span.end()
+
+    def _trace_sleep(self, sleep: float, response: Response, **kwargs):
+        name = "report_wait" if response.status_code in (201, 202) else "retry_sleep"
+        return self._trace_phase(name, **kwargs)
+
+    def _record_metric(
+        self,
+        name: str,
+        value: float,
+        api_params: dict,
+        resource_name: str = None,
+        labels: dict = None,
+        **kwargs
+    ) -> None:
+        metrics = api_params.get("metrics")
+        if metrics is not None:
+            metrics.record(
+                name,
+                value,
+                {
+                    "login": api_params.get("login") or "",
+                    "resource": resource_name or "",
+                    **(labels or {}),
+                },
+            )
+
+    def _record_response_metrics(
+        self, response: Response, request_kwargs: dict, api_params: dict, **kwargs
+    ) -> None:
+        if api_params.get("metrics") is None:
+            return
+
+        record = functools.partial(self._record_metric, api_params=api_params, **kwargs)
+        record("request_seconds", response.elapsed.total_seconds())
+        if request_kwargs.get("stream"):
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        record("response_bytes", size)
+
+        units = response.headers.get("Units")
+        if units:
+            spent, remaining, _ = limiter.parse_units_header(units)
+            record("units_spent", spent)
+            record("units_remaining", remaining)
+
     def error_handling(
         self,
         tapi_exception: TapiException,
@@ -187,6 +628,23 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
         api_params: dict,
         **kwargs
     ) -> None:
+        if response.status_code not in (201, 202):
+            error_code = error_message.get("error", {}).get("error_code")
+            self._record_metric(
+                "errors",
+                1,
+                api_params,
+                labels={"code": str(error_code or response.status_code)},
+                **kwargs
+            )
+            self._end_trace(
+                kwargs["store"],
+                error=True,
+                error_code=error_code or response.status_code,
+            )
+        else:
+            self._end_trace(kwargs["store"])
+
         if response.status_code in (201, 202):
             pass
         elif "error_text" in error_message:
@@ -195,7 +653,7 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
             )
         else:
             error_data = error_message.get("error", {})
-            error_code = int(error_data.get("code", 0))
+            error_code = int(error_data.get("error_code", 0))
 
             if error_code == 152:
                 raise exceptions.YandexDirectNotEnoughUnitsError(
@@ -227,50 +685,111 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
         api_params: dict,
         **kwargs
     ) -> bool:
+        sleep = self._get_retry_sleep(
+            tapi_exception,
+            error_message,
+            repeat_number,
+            response,
+            request_kwargs,
+            api_params,
+            **kwargs
+        )
+        if sleep is None:
+            return False
+
+        with self._trace_sleep(sleep, response, api_params=api_params, **kwargs):
+            time.sleep(sleep)
+        return True
+
+    def _get_retry_sleep(
+        self,
+        tapi_exception: TapiException,
+        error_message: dict,
+        repeat_number: int,
+        response: Response,
+        request_kwargs: dict,
+        api_params: dict,
+        **kwargs
+    ) -> Optional[float]:
+        """Number of seconds to wait before repeating the request, None if not to repeat."""
         status_code = response.status_code
         error_data = error_message.get("error", {})
-        error_code = int(error_data.get("code", 0))
+        error_code = int(error_data.get("error_code", 0))
+
+        store = kwargs["store"]
+        if repeat_number == 1:
+            # The first repeat of the request, the errors are counted anew.
+            store["retry_number"] = 0
+            store.pop("retry_started", None)
 
         if status_code in (201, 202):
             logger.info("Report not ready")
             if api_params.get("wait_report", True):
                 sleep = int(response.headers.get("retryIn", 10))
                 logger.info("Re-request after {} seconds".format(sleep))
-                time.sleep(sleep)
-                return True
+                self._record_metric("report_wait_seconds", sleep, api_params, **kwargs)
+                return sleep
+
+        policy = (
+            request_kwargs.get("retry_policy")
+            or api_params.get("retry_policy")
+            or retry.DEFAULT_RETRY_POLICY
+        )
+        # Waiting for the report is not an error,
+        # only the errors count towards the backoff and the elapsed time.
+        store["retry_number"] = retry_number = store.get("retry_number", 0) + 1
+        if retry_number == 1:
+            store["retry_started"] = time.monotonic()
+        elapsed = time.monotonic() - store["retry_started"]
+        hint = response.headers.get("Retry-After")
+        hint = float(hint) if hint and hint.isdigit() else None
 
+        def get_delay(code: int) -> Optional[float]:
+            return policy.get_policy(code).get_delay(retry_number, elapsed, hint)
+
+        sleep = None
         if error_code == 152:
             if api_params.get("retry_if_not_enough_units", False):
-                logger.warning("Not enough units, re-request after 5 minutes")
-                time.sleep(60 * 5)
-                return True
+                units_limiter = api_params.get("units_limiter")
+                if hint is None and units_limiter is not None:
+                    hint = units_limiter.get_delay(api_params.get("login")) or None
+                sleep = get_delay(error_code)
+                if sleep is not None:
+                    logger.warning(
+                        "Not enough units, re-request after {:.0f} seconds".format(
+                            sleep
+                        )
+                    )
             else:
                 logger.error("Not enough units to request")
 
-        elif error_code == 506 and api_params.get("retry_if_exceeded_limit", True):
-            logger.warning("API requests exceeded, re-request after 10 seconds")
-            time.sleep(10)
-            return True
+        elif error_code in LIMIT_ERROR_MESSAGES and api_params.get(
+            "retry_if_exceeded_limit", True
+        ):
+            sleep = get_delay(error_code)
+            if sleep is not None:
+                logger.warning(
+                    "{}. Re-request after {:.1f} seconds".format(
+                        LIMIT_ERROR_MESSAGES[error_code], sleep
+                    )
+                )
 
-        elif error_code == 56 and api_params.get("retry_if_exceeded_limit", True):
-            logger.warning("Method request limit exceeded. Re-request after 10 seconds")
-            time.sleep(10)
-            return True
+        elif error_code in (52, 1000, 1001, 1002) or status_code == 500:
+            if retry_number < api_params.get("retries_if_server_error", 5):
+                sleep = get_delay(error_code or status_code)
+                if sleep is not None:
+                    logger.warning(
+                        "Server error. Re-request after {:.1f} seconds".format(sleep)
+                    )
 
-        elif error_code == 9000 and api_params.get("retry_if_exceeded_limit", True):
-            logger.warning(
-                "Created by max number of reports. Re-request after 10 seconds"
+        if sleep is not None:
+            labels = {"code": str(error_code or status_code)}
+            self._record_metric("retries", 1, api_params, labels=labels, **kwargs)
+            self._record_metric(
+                "retry_sleep_seconds", sleep, api_params, labels=labels, **kwargs
             )
-            time.sleep(10)
-            return True
-
-        elif error_code in (52, 1000, 1001, 1002) or status_code == 500:
-            if repeat_number < api_params.get("retries_if_server_error", 5):
-                logger.warning("Server error. Re-request after 1 second")
-                time.sleep(1)
-                return True
 
-        return False
+        return sleep
 
     def get_iterator_next_request_kwargs(
         self,
@@ -287,6 +806,70 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
 
             return request_kwargs
 
+    def prefetch_pages(
+        self,
+        data: Dict[str, dict],
+        response: Response,
+        request_kwargs: dict,
+        client: TapiClientExecutor,
+        workers: int = 4,
+        max_pages: int = None,
+        **kwargs
+    ) -> Iterator[TapiClient]:
+        """
+        Iterates pages like pages(), but keeps several page requests in flight.
+
+        Offsets of the next pages are calculated by the size of the first page,
+        the iteration stops at the first page without LimitedBy.
+        Pages after the last one can be requested in vain, it costs units.
+        """
+        yield client._wrap_in_tapi(self.extract(data, response, request_kwargs))
+
+        offset = request_kwargs["data"]["params"].get("Page", {}).get("Offset", 0)
+        limit = data["result"].get("LimitedBy")
+        if not limit or max_pages == 1:
+            return
+
+        page_size = limit - offset
+        method = response.request.method.lower()
+        page_count = 1
+
+        def request_page(page_offset: int) -> TapiClient:
+            body = copy.deepcopy(request_kwargs["data"])
+            body["params"]["Page"] = {"Limit": page_size, "Offset": page_offset}
+            request_method = getattr(copy_executor(client), method)
+            return request_method(**{**request_kwargs, "data": body})
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        futures = collections.deque()
+        try:
+            while True:
+                while len(futures) < workers and (
+                    max_pages is None or page_count + len(futures) < max_pages
+                ):
+                    futures.append(pool.submit(request_page, limit))
+                    limit += page_size
+
+                if not futures:
+                    break
+
+                page_response = futures.popleft().result()
+                page_count += 1
+                yield page_response._wrap_in_tapi(
+                    self.extract(
+                        page_response.data,
+                        page_response.response,
+                        page_response.request_kwargs,
+                    )
+                )
+
+                if not page_response.data["result"].get("LimitedBy"):
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+
     def get_iterator_pages(self, response_data: dict, **kwargs) -> List[List[dict]]:
         return [self.extract(response_data, **kwargs)]
 
@@ -298,48 +881,344 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
     def get_iterator_iteritems(self, response_data: dict, **kwargs) -> List[dict]:
         return self.extract(response_data, **kwargs)
 
-    def _iter_lines(self, data: str, response: Response, **kwargs) -> Iterator[str]:
+    def _iter_lines(
+        self, data: Union[str, Iterator[str]], response: Response, **kwargs
+    ) -> Iterator[str]:
         if response.request.path_url != REPORTS_RESOURCE_URL:
             raise NotImplementedError("For reports resource only")
 
-        lines = io.StringIO(data)
-        iterator = (line.replace("\n", "") for line in lines)
+        if not isinstance(data, str):
+            # Streaming report, lines are read directly from the socket.
+            return data
 
-        return iterator
+        return iter_text_lines(data)
 
     def iter_lines(self, **kwargs) -> Iterator[str]:
         iterator = self._iter_lines(**kwargs)
-        next(iterator)  # skipping columns
+        next(iterator, None)  # skipping columns
         yield from iterator
 
-    def iter_values(self, **kwargs) -> Iterator[list]:
+    def iter_values(self, columns: List[str] = None, **kwargs) -> Iterator[list]:
+        """
+        :param columns: only these columns are returned,
+            the lines are split only up to the last of them.
+        """
+        if columns:
+            yield from self._iter_column_values(columns, **kwargs)
+            return
+
         for line in self.iter_lines(**kwargs):
             yield line.split("\t")
 
-    def iter_dicts(self, **kwargs) -> Iterator[dict]:
-        for line in self.iter_lines(**kwargs):
-            yield dict(zip(kwargs["store"]["columns"], line.split("\t")))
+    def _iter_column_values(
+        self, columns: List[str], store: dict, **kwargs
+    ) -> Iterator[list]:
+        try:
+            indexes = [store["columns"].index(column) for column in columns]
+        except ValueError:
+            raise KeyError(
+                "Columns {} are not in the report".format(
+                    set(columns) - set(store["columns"])
+                )
+            )
+        if len(indexes) == 1:
+            index = indexes[0]
+            getter = lambda values: (values[index],)
+        else:
+            getter = operator.itemgetter(*indexes)
 
+        # The pipeline of map runs without a Python frame for each line.
+        lines = self.iter_lines(store=store, **kwargs)
+        values = map(
+            str.split, lines, itertools.repeat("\t"), itertools.repeat(max(indexes) + 1)
+        )
+        return map(list, map(getter, values))
+
+    def iter_dicts(self, columns: List[str] = None, **kwargs) -> Iterator[dict]:
+        keys = columns or kwargs["store"]["columns"]
+        for values in self.iter_values(columns=columns, **kwargs):
+            yield dict(zip(keys, values))
+
+    def iter_records(self, columns: List[str] = None, **kwargs) -> Iterator[tuple]:
+        """Rows as named tuples, see create_record_class."""
+        record_class = create_record_class(tuple(columns or kwargs["store"]["columns"]))
+        return map(record_class._make, self.iter_values(columns=columns, **kwargs))
+
+    @traced
+    def to_records(self, **kwargs) -> List[tuple]:
+        return list(self.iter_records(**kwargs))
+
+    @traced
     def to_values(self, **kwargs) -> List[list]:
         return list(self.iter_values(**kwargs))
 
+    @traced
     def to_lines(self, **kwargs) -> List[str]:
         return list(self.iter_lines(**kwargs))
 
-    def to_columns(self, **kwargs):
-        columns = [[] for _ in range(len(kwargs["store"]["columns"]))]
-        for values in self.iter_values(**kwargs):
-            for i, col in enumerate(columns):
-                col.append(values[i])
+    @traced
+    def to_columns(self, columns: List[str] = None, **kwargs) -> List[list]:
+        count = len(columns or kwargs["store"]["columns"])
+        values = self.iter_values(columns=columns, **kwargs)
+        return [list(column) for column in zip(*values)] or [[] for _ in range(count)]
+
+    def _read_arrow_csv(
+        self,
+        data: Union[str, Iterator[str]],
+        response: Response,
+        request_kwargs: dict,
+        store: dict,
+        streaming: bool = False,
+        **kwargs
+    ):
+        import pyarrow
+        from pyarrow import csv
+
+        if response.request.path_url != REPORTS_RESOURCE_URL:
+            raise NotImplementedError("For reports resource only")
 
-        return columns
+        if isinstance(data, str):
+            source = io.BytesIO(response.content)
+        else:
+            source = LinesReader(data)
 
-    def to_dict(self, **kwargs) -> List[dict]:
+        types = {
+            "int": pyarrow.int64(),
+            "float": pyarrow.float64(),
+            "date": pyarrow.date32(),
+            "str": pyarrow.string(),
+        }
+        money_in_micros = request_kwargs["headers"]["returnMoneyInMicros"] == "true"
+        column_types = {
+            column: types[report_fields.get_field_type(column, money_in_micros)]
+            for column in store["columns"]
+        }
+
+        read = csv.open_csv if streaming else csv.read_csv
+        return read(
+            source,
+            parse_options=csv.ParseOptions(delimiter="\t", quote_char=False),
+            convert_options=csv.ConvertOptions(
+                column_types=column_types, null_values=[report_fields.NULL_VALUE]
+            ),
+        )
+
+    @traced
+    def aggregate(
+        self, by: List[str], sum: List[str], request_kwargs: dict, store: dict, **kwargs
+    ) -> List[dict]:
+        """
+        Sums of the columns grouped by the values of other columns.
+
+        The rows are folded in one pass, the values are converted once
+        and the memory depends on the number of groups, not on the number of rows.
+
+        :param by: columns of the groups, the groups are in the order of appearance.
+        :param sum: numeric columns, integer fields are summed as int,
+            others as float, "--" is skipped.
+        """
+        if not sum:
+            raise ValueError("Columns to sum are not set")
+
+        try:
+            by_indexes = [store["columns"].index(column) for column in by]
+            sum_indexes = [store["columns"].index(column) for column in sum]
+        except ValueError:
+            raise KeyError(
+                "Columns {} are not in the report".format(
+                    set(by + sum) - set(store["columns"])
+                )
+            )
+
+        money_in_micros = request_kwargs["headers"]["returnMoneyInMicros"] == "true"
+        converters = []
+        for column in sum:
+            field_type = report_fields.get_field_type(column, money_in_micros)
+            if field_type not in ("int", "float"):
+                raise ValueError("Column '{}' is not numeric".format(column))
+            converters.append(int if field_type == "int" else float)
+
+        # itemgetter of one index returns the value instead of a tuple.
+        get_key = operator.itemgetter(*by_indexes) if by_indexes else lambda _: ()
+        if len(sum_indexes) == 1:
+            index = sum_indexes[0]
+            get_values = lambda values: (values[index],)
+        else:
+            get_values = operator.itemgetter(*sum_indexes)
+
+        null_value = report_fields.NULL_VALUE
+        zeros = [0] * len(sum)
+        groups = {}
+        for line in self.iter_lines(
+            request_kwargs=request_kwargs, store=store, **kwargs
+        ):
+            values = line.split("\t")
+            key = get_key(values)
+            groups[key] = [
+                total + convert(value) if value != null_value else total
+                for total, convert, value in zip(
+                    groups.get(key, zeros), converters, get_values(values)
+                )
+            ]
+
+        if len(by) == 1:
+            groups = {(key,): totals for key, totals in groups.items()}
         return [
-            dict(zip(kwargs["store"]["columns"], values))
-            for values in self.iter_values(**kwargs)
+            {**dict(zip(by, key)), **dict(zip(sum, totals))}
+            for key, totals in groups.items()
         ]
 
+    @traced
+    def to_arrow(self, **kwargs) -> "pyarrow.Table":
+        """Report as a table of pyarrow, the column types are set by the report fields."""
+        return self._read_arrow_csv(**kwargs)
+
+    @traced
+    def to_numpy(self, **kwargs) -> Dict[str, "numpy.ndarray"]:
+        table = self.to_arrow(**kwargs)
+        return {
+            column: table.column(column).to_numpy() for column in table.column_names
+        }
+
+    @traced
+    def to_pandas(self, **kwargs) -> "pandas.DataFrame":
+        return self.to_arrow(**kwargs).to_pandas()
+
+    @traced
+    def save(
+        self,
+        path: Union[str, Path],
+        format: str = "tsv",
+        extra_columns: Dict[str, str] = None,
+        row_group_size: int = 1000000,
+        **kwargs
+    ) -> Path:
+        """
+        Saves the report to the file.
+
+        The report is written in chunks, with a streaming report the memory is constant.
+
+        :param path: file path.
+        :param format: tsv, csv, jsonl or parquet (requires pyarrow).
+        :param extra_columns: columns with constant values added to each row,
+            for example {"login": "my-login"}.
+        :param row_group_size: (parquet) number of rows in the row group.
+        """
+        path = Path(path)
+        extra_columns = extra_columns or {}
+
+        if format == "tsv":
+            self._save_tsv(path, extra_columns, **kwargs)
+        elif format == "csv":
+            self._save_csv(path, extra_columns, **kwargs)
+        elif format == "jsonl":
+            self._save_jsonl(path, extra_columns, **kwargs)
+        elif format == "parquet":
+            self._save_parquet(path, extra_columns, row_group_size, **kwargs)
+        else:
+            raise ValueError("Format '{}' is not supported".format(format))
+
+        return path
+
+    def _iter_body_chunks(
+        self, data: Union[str, Iterator[str]], response: Response, **kwargs
+    ) -> Iterator[bytes]:
+        """Body of the report after the line of columns, without decoding."""
+        if response.request.path_url != REPORTS_RESOURCE_URL:
+            raise NotImplementedError("For reports resource only")
+
+        if isinstance(data, str):
+            content = memoryview(response.content)
+            start = response.content.find(b"\n") + 1 or len(content)
+            return (
+                content[i : i + REPORT_STREAM_CHUNK_SIZE]
+                for i in range(start, len(content), REPORT_STREAM_CHUNK_SIZE)
+            )
+        return data.iter_chunks()
+
+    def _save_tsv(
+        self, path: Path, extra_columns: Dict[str, str], store: dict, **kwargs
+    ) -> None:
+        chunks = self._iter_body_chunks(store=store, **kwargs)
+        header = "\t".join(store["columns"] + list(extra_columns)) + "\n"
+        with open(path, "wb", buffering=REPORT_STREAM_CHUNK_SIZE) as f:
+            f.write(header.encode())
+            if not extra_columns:
+                f.writelines(chunks)
+                return
+
+            # The bytes of the line break are not a part of other UTF-8 characters,
+            # so the lines are split without decoding.
+            line_end = (
+                "".join("\t" + str(value) for value in extra_columns.values()).encode()
+                + b"\n"
+            )
+            tail = b""
+            for chunk in chunks:
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                if lines:
+                    f.write(line_end.join(lines))
+                    f.write(line_end)
+            if tail:
+                f.write(tail + line_end)
+
+    def _save_csv(
+        self, path: Path, extra_columns: Dict[str, str], store: dict, **kwargs
+    ) -> None:
+        extra_values = [str(value) for value in extra_columns.values()]
+        with open(path, "w", newline="", buffering=REPORT_STREAM_CHUNK_SIZE) as f:
+            writer = csv.writer(f)
+            writer.writerow(store["columns"] + list(extra_columns))
+            for values in self.iter_values(store=store, **kwargs):
+                writer.writerow(values + extra_values)
+
+    def _save_jsonl(
+        self, path: Path, extra_columns: Dict[str, str], store: dict, **kwargs
+    ) -> None:
+        keys = store["columns"] + list(extra_columns)
+        extra_values = list(extra_columns.values())
+        with open(path, "wb", buffering=REPORT_STREAM_CHUNK_SIZE) as f:
+            for values in self.iter_values(store=store, **kwargs):
+                f.write(orjson.dumps(dict(zip(keys, values + extra_values))))
+                f.write(b"\n")
+
+    def _save_parquet(
+        self, path: Path, extra_columns: Dict[str, str], row_group_size: int, **kwargs
+    ) -> None:
+        import pyarrow
+        from pyarrow import parquet
+
+        reader = self._read_arrow_csv(streaming=True, **kwargs)
+        schema = reader.schema
+        for name in extra_columns:
+            schema = schema.append(pyarrow.field(name, pyarrow.string()))
+
+        def write(batches: List["pyarrow.RecordBatch"]) -> None:
+            table = pyarrow.Table.from_batches(batches, schema=reader.schema)
+            for name, value in extra_columns.items():
+                table = table.append_column(
+                    name, pyarrow.repeat(pyarrow.scalar(str(value)), table.num_rows)
+                )
+            writer.write_table(table, row_group_size=row_group_size)
+
+        with parquet.ParquetWriter(str(path), schema) as writer:
+            batches = []
+            rows = 0
+            for batch in reader:
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= row_group_size:
+                    write(batches)
+                    batches = []
+                    rows = 0
+            if batches:
+                write(batches)
+
+    @traced
+    def to_dict(self, **kwargs) -> List[dict]:
+        return list(self.iter_dicts(**kwargs))
+
     def to_dicts(self, **kwargs) -> List[dict]:
         return self.to_dict(**kwargs)
 
@@ -379,4 +1258,116 @@ class YandexDirectClientAdapter(JSONAdapterMixin, TapiAdapter):
         raise exceptions.BackwardCompatibilityError("method 'transform'")
 
 
-YandexDirect = generate_wrapper_from_adapter(YandexDirectClientAdapter)
+def create_session(
+    pool_maxsize: int = DEFAULT_POOLSIZE, max_retries: int = 0, **kwargs
+) -> Session:
+    """
+    Session with a pool of keep-alive connections to the API.
+
+    One session can be passed to the clients of different logins,
+    the login is sent in the request headers, so the connections are reused.
+
+    :param pool_maxsize: maximum number of connections to the host,
+        set it to the number of threads sending requests.
+    :param max_retries: number of retries of failed connections.
+    :param kwargs: other parameters of requests.adapters.HTTPAdapter.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=max_retries, **kwargs)
+    session.mount("https://", adapter)
+    return session
+
+
+def copy_executor(executor: TapiClientExecutor) -> TapiClientExecutor:
+    """
+    Copy of the executor with its own store for a request sent in parallel with others.
+    The store keeps the state of the request: the count of its retries and its spans.
+    """
+    return TapiClientExecutor(
+        executor._api,
+        data=executor.data,
+        response=executor._response,
+        request_kwargs=executor.request_kwargs,
+        api_params=executor._api_params,
+        resource=executor._resource,
+        refresh_token_by_default=executor._refresh_token_default,
+        refresh_data=executor.refresh_data,
+        session=executor._session,
+        store=dict(executor.store),
+        resource_name=executor._resource_name,
+    )
+
+
+class YandexDirectSession(Session):
+    """
+    Session of one client over the session passed to the client.
+
+    The settings and the adapters with the connection pools are those of the passed session,
+    so the clients of one session share the connections.
+    The request waits for the units limiter of the client before it is sent
+    and the slot of the request is released when the response is received
+    or the request failed.
+    The response and report caches of the client serve only the requests of the client.
+    """
+
+    def __init__(self, session: Session, api_params: dict):
+        super().__init__()
+        for name in self.__attrs__:
+            setattr(self, name, getattr(session, name))
+        self.api_params = api_params
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        send = functools.partial(super().send, request, **kwargs)
+        # Start times of the pause before the request and of the request for tracing.
+        times = [time.time_ns()] * 2
+
+        def send_reserved() -> Response:
+            self._wait_for_limiter(request.url)
+            times[1] = time.time_ns()
+            try:
+                return send()
+            finally:
+                release_request(self.api_params)
+
+        client_cache = self._get_cache(request.url)
+        if client_cache is None:
+            response = send_reserved()
+        else:
+            # The responses from the cache do not take the units and the slot,
+            # they have no Units header to correct the reserved units.
+            response = client_cache.send(
+                request, send_reserved, stream=kwargs.get("stream", False)
+            )
+        response.request_times = tuple(times)
+        return response
+
+    def _wait_for_limiter(self, url: str) -> None:
+        delay = get_request_delay(self.api_params, url)
+        while delay is None:
+            time.sleep(limiter.SLOT_POLL_INTERVAL)
+            delay = get_request_delay(self.api_params, url)
+        if delay:
+            time.sleep(delay)
+
+    def _get_cache(
+        self, url: str
+    ) -> Union[None, cache.ReportCache, cache.ResponseCache]:
+        """Cache of the client that serves the URL, the report cache first."""
+        for name in ("report_cache", "response_cache"):
+            client_cache = self.api_params.get(name)
+            if client_cache is not None and url.startswith(client_cache.urls):
+                return client_cache
+        return None
+
+
+class YandexDirectInstantiator(TapiInstantiator):
+    def __call__(self, session: Session = None, **kwargs) -> TapiClient:
+        if session is None:
+            session = create_session(
+                pool_maxsize=kwargs.get("pool_maxsize", DEFAULT_POOLSIZE)
+            )
+
+        return super().__call__(session=YandexDirectSession(session, kwargs), **kwargs)
+
+
+YandexDirect = YandexDirectInstantiator(YandexDirectClientAdapter)
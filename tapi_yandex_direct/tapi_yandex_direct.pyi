@@ -1,6 +1,13 @@
-from typing import List, Iterator, Union
+from pathlib import Path
+from typing import Dict, List, Iterator, Union
 
-from requests import Response
+from requests import Response, Session
+
+from tapi_yandex_direct.cache import ReportCache, ResponseCache
+from tapi_yandex_direct.limiter import UnitsLimiter
+from tapi_yandex_direct.metrics import CallbackMetrics, PrometheusMetrics
+from tapi_yandex_direct.retry import RetryPolicy
+from tapi_yandex_direct.tracing import JsonFileTracer, OpenTelemetryTracer
 
 class YandexDirectBaseMethodsClientResponse:
     @property
@@ -20,6 +27,9 @@ class YandexDirectClientResponse(YandexDirectBaseMethodsClientResponse):
         self, *, max_pages: int = None
     ) -> Iterator["YandexDirectPageIteratorExecutor"]: ...
     def items(self, *, max_items: int = None) -> Iterator[dict]: ...
+    def prefetch_pages(
+        self, *, workers: int = 4, max_pages: int = None
+    ) -> Iterator["YandexDirectPageIteratorExecutor"]: ...
     def iter_items(
         self, *, max_pages: int = None, max_items: int = None
     ) -> Iterator[dict]: ...
@@ -36,22 +46,34 @@ class YandexDirectClientExecutor:
     def help(self) -> YandexDirectClientExecutor:
         """Print docs of resource."""
     def get(
-        self, *, params: dict = None, data: dict = None, headers: dict = None
+        self,
+        *,
+        params: dict = None,
+        data: dict = None,
+        headers: dict = None,
+        retry_policy: RetryPolicy = None
     ) -> YandexDirectClientExecutorResponse:
         """
         Send HTTP 'GET' request.
 
         :param params: querystring arguments in the URL
         :param data: send data in the body of the request
+        :param retry_policy: waits between retries of this request, instead of the client policy
         """
     def post(
-        self, *, params: dict = None, data: dict = None, headers: dict = None
+        self,
+        *,
+        params: dict = None,
+        data: dict = None,
+        headers: dict = None,
+        retry_policy: RetryPolicy = None
     ) -> YandexDirectClientExecutorResponse:
         """
         Send HTTP 'POST' request.
 
         :param params: querystring arguments in the URL
         :param data: send data in the body of the request
+        :param retry_policy: waits between retries of this request, instead of the client policy
         """
 
 class YandexDirectPageIteratorResponse(YandexDirectBaseMethodsClientResponse):
@@ -63,12 +85,26 @@ class YandexDirectPageIteratorExecutor(YandexDirectBaseMethodsClientResponse):
 # Yandex Direct reports.
 class YandexDirectClientReportResponse(YandexDirectBaseMethodsClientResponse):
     def iter_lines(self) -> Iterator[str]: ...
-    def iter_values(self) -> Iterator[list]: ...
-    def iter_dicts(self) -> Iterator[dict]: ...
+    def iter_values(self, *, columns: List[str] = None) -> Iterator[list]: ...
+    def iter_dicts(self, *, columns: List[str] = None) -> Iterator[dict]: ...
     def to_lines(self) -> List[str]: ...
-    def to_values(self) -> List[list]: ...
-    def to_columns(self) -> List[list]: ...
-    def to_dicts(self) -> List[dict]: ...
+    def to_values(self, *, columns: List[str] = None) -> List[list]: ...
+    def to_columns(self, *, columns: List[str] = None) -> List[list]: ...
+    def to_dicts(self, *, columns: List[str] = None) -> List[dict]: ...
+    def iter_records(self, *, columns: List[str] = None) -> Iterator[tuple]: ...
+    def to_records(self, *, columns: List[str] = None) -> List[tuple]: ...
+    def aggregate(self, *, by: List[str], sum: List[str]) -> List[dict]: ...
+    def to_arrow(self) -> "pyarrow.Table": ...
+    def to_numpy(self) -> Dict[str, "numpy.ndarray"]: ...
+    def to_pandas(self) -> "pandas.DataFrame": ...
+    def save(
+        self,
+        *,
+        path: Union[str, Path],
+        format: str = "tsv",
+        extra_columns: Dict[str, str] = None,
+        row_group_size: int = 1000000
+    ) -> Path: ...
 
 class YandexDirectClientReportExecutorResponse(YandexDirectBaseMethodsClientResponse):
     def __call__(self) -> YandexDirectClientReportResponse: ...
@@ -83,45 +119,73 @@ class YandexDirectClientReportExecutor:
     def help(self) -> YandexDirectClientReportExecutor:
         """Print docs of resource."""
     def post(
-        self, *, params: dict = None, data: dict = None, headers: dict = None
+        self,
+        *,
+        params: dict = None,
+        data: dict = None,
+        headers: dict = None,
+        retry_policy: RetryPolicy = None
     ) -> YandexDirectClientReportExecutorResponse:
         """
         Send HTTP 'POST' request.
 
         :param params: querystring arguments in the URL
         :param data: send data in the body of the request
+        :param retry_policy: waits between retries of this request, instead of the client policy
         """
 
 # Main.
+def create_session(
+    pool_maxsize: int = 10, max_retries: int = 0, **kwargs
+) -> Session: ...
+
 class YandexDirect:
     def __init__(
         self,
         *,
         access_token: str,
+        session: Session = None,
+        pool_maxsize: int = 10,
         login: str = None,
         is_sandbox: bool = False,
+        api_root: str = None,
         retry_if_not_enough_units: bool = False,
         retry_if_exceeded_limit: bool = True,
         retries_if_server_error: int = 5,
+        retry_policy: RetryPolicy = None,
         language: str = None,
+        units_limiter: UnitsLimiter = None,
+        response_cache: ResponseCache = None,
+        metrics: Union[CallbackMetrics, PrometheusMetrics] = None,
+        tracer: Union[JsonFileTracer, OpenTelemetryTracer] = None,
         processing_mode: str = "offline",
         wait_report: bool = True,
         return_money_in_micros: bool = False,
         skip_report_header: bool = True,
         skip_column_header: bool = False,
         skip_report_summary: bool = True,
+        stream_report: bool = False,
+        report_cache: ReportCache = None,
     ):
         """
         Official documentation of the reports resource: https://yandex.ru/dev/direct/doc/ref-v5/concepts/about.html
         Official documentation of other resources: https://yandex.ru/dev/direct/doc/reports/how-to.html
 
         :param access_token: Access token.
+        :param session: Session of requests, can be shared by the clients of different logins, see create_session.
+        :param pool_maxsize: Maximum number of connections to the host, if the session is not passed.
         :param login: If you are making inquiries from an agent account, you must be sure to specify the account login.
         :param is_sandbox: Enable sandbox.
+        :param api_root: Root URL of the API, for example of the local emulator.
         :param retry_if_not_enough_units: Repeat request when units run out
         :param retry_if_exceeded_limit: Repeat the request if the limits on the number of reports or requests are exceeded.
         :param retries_if_server_error: Number of retries when server errors occur.
+        :param retry_policy: Waits between retries, exponential backoff with jitter by default.
         :param language: The language in which the data for directories and errors will be returned.
+        :param units_limiter: Pauses requests before the units of the login run out.
+        :param response_cache: Cache of the responses of the get method for reference resources.
+        :param metrics: Receives the metrics of the requests: latency, bytes, rows, units, retries and errors.
+        :param tracer: Creates the spans of the requests, retries, waits for reports and parsing.
 
         :param processing_mode: (report resource) Report generation mode: online, offline or auto.
         :param wait_report: (report resource) When requesting a report, it will wait until the report is prepared and download it.
@@ -129,6 +193,8 @@ class YandexDirect:
         :param skip_report_header: (report resource) Do not display a line with the report name and date range in the report.
         :param skip_column_header: (report resource) Do not display a line with field names in the report.
         :param skip_report_summary: (report resource) Do not display a line with the number of statistics lines in the report.
+        :param stream_report: (report resource) Read the report lines directly from the socket, without loading the whole report into memory. The lines can be iterated only once.
+        :param report_cache: (report resource) Local cache of reports with a closed period, the ReportName is generated by the report parameters.
         """
     def reports(self) -> YandexDirectClientReportExecutor: ...
     def adextensions(self) -> YandexDirectClientExecutor: ...
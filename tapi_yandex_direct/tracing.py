@@ -0,0 +1,134 @@
+import itertools
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+import orjson
+
+
+class JsonSpan:
+    """Span of JsonFileTracer, has the methods of the OpenTelemetry span it uses."""
+
+    def __init__(
+        self,
+        tracer: "JsonFileTracer",
+        name: str,
+        span_id: int,
+        parent: Optional["JsonSpan"],
+        attributes: dict,
+        start_time: int,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = span_id
+        self.parent = parent
+        self.attributes = attributes
+        self.start_time = start_time
+        self.thread_id = threading.get_ident()
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def end(self, end_time: Optional[int] = None) -> None:
+        self.tracer._add(self, end_time or time.time_ns())
+
+
+class JsonFileTracer:
+    """
+    Writes the spans to the JSON file in the Trace Event Format,
+    it is opened by chrome://tracing, Perfetto and speedscope as a flame graph.
+
+        with JsonFileTracer("trace.json") as tracer:
+            client = YandexDirect(access_token=ACCESS_TOKEN, tracer=tracer)
+            ...
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: file, is written by save() and on exit from the with block.
+        """
+        self.path = Path(path)
+        self.events = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[JsonSpan] = None,
+        attributes: dict = None,
+        start_time: Optional[int] = None,
+    ) -> JsonSpan:
+        """
+        :param parent: span of the outer phase.
+        :param start_time: nanoseconds since the epoch, by default now.
+        """
+        return JsonSpan(
+            self,
+            name,
+            next(self._ids),
+            parent,
+            dict(attributes or {}),
+            start_time or time.time_ns(),
+        )
+
+    def _add(self, span: JsonSpan, end_time: int) -> None:
+        args = {"span_id": span.span_id, **span.attributes}
+        if span.parent is not None:
+            args["parent_id"] = span.parent.span_id
+        event = {
+            "name": span.name,
+            "cat": "yandex_direct",
+            "ph": "X",
+            "ts": span.start_time / 1000,
+            "dur": (end_time - span.start_time) / 1000,
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def save(self) -> Path:
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["ts"])
+        self.path.write_bytes(orjson.dumps({"traceEvents": events}))
+        return self.path
+
+    def __enter__(self) -> "JsonFileTracer":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.save()
+
+
+class OpenTelemetryTracer:
+    """
+    Creates the spans by the OpenTelemetry tracer, requires 'pip install opentelemetry-api'
+    and the SDK with an exporter configured by the application.
+
+        client = YandexDirect(access_token=ACCESS_TOKEN, tracer=OpenTelemetryTracer())
+    """
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: opentelemetry.trace.Tracer, by default of the global provider.
+        """
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("tapi_yandex_direct")
+
+    def start_span(
+        self,
+        name: str,
+        parent=None,
+        attributes: dict = None,
+        start_time: Optional[int] = None,
+    ):
+        context = None if parent is None else self._trace.set_span_in_context(parent)
+        return self.tracer.start_span(
+            name, context=context, attributes=attributes, start_time=start_time
+        )
@@ -1,8 +1,52 @@
+import asyncio
+import collections
+import importlib.util
+import itertools
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+import orjson
+import pytest
+import requests
 import responses
 
-from tapi_yandex_direct import YandexDirect
+from tapi_yandex_direct import YandexDirect, AsyncYandexDirect, create_session
+from tapi_yandex_direct.batch import get_batch_limit, post_batches, split_request
+from tapi_yandex_direct.cache import (
+    MemoryCacheBackend,
+    ReportCache,
+    ResponseCache,
+    SqliteCacheBackend,
+    create_report_name,
+)
+from tapi_yandex_direct.emulator import ApiEmulator
+from tapi_yandex_direct.exceptions import (
+    YandexDirectApiError,
+    YandexDirectRequestsLimitError,
+)
+from tapi_yandex_direct.limiter import (
+    RELEASE_LOCK_SCRIPT,
+    RedisLimiterBackend,
+    SqliteLimiterBackend,
+    UnitsLimiter,
+)
+from tapi_yandex_direct.metrics import CallbackMetrics, PrometheusMetrics
+from tapi_yandex_direct.reports import (
+    ReportScheduler,
+    fetch_report_by_date_ranges,
+    fetch_reports,
+    iter_merged_lines,
+)
+from tapi_yandex_direct.retry import RetryPolicy
+from tapi_yandex_direct.sync import IncrementalSync, SqliteSnapshot
+from tapi_yandex_direct.tracing import JsonFileTracer, OpenTelemetryTracer
+from tapi_yandex_direct.tapi_yandex_direct import (
+    ReportStream,
+    YandexDirectClientAdapter,
+)
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -193,3 +237,1322 @@ def test_get_report():
         {"col1": "value1", "col2": "value2"},
         {"col1": "value10", "col2": "value20"},
     ]
+
+
+@responses.activate
+def test_get_report_stream():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        headers={"retryIn": "0"},
+        status=201,
+    )
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="col1\tcol2\nзначение1\tvalue2\nvalue10\tvalue20\n".encode(),
+        status=200,
+    )
+    stream_client = YandexDirect(access_token="", stream_report=True)
+    report = stream_client.reports().post(
+        data={
+            "params": {
+                "SelectionCriteria": {},
+                "FieldNames": ["Date", "CampaignId"],
+                "ReportName": "report name",
+                "ReportType": "CAMPAIGN_PERFORMANCE_REPORT",
+                "DateRangeType": "TODAY",
+                "Format": "TSV",
+                "IncludeVAT": "YES",
+                "IncludeDiscount": "YES",
+            }
+        }
+    )
+    assert report.request_kwargs["stream"] is True
+    assert report.columns == ["col1", "col2"]
+    assert report().to_values() == [["значение1", "value2"], ["value10", "value20"]]
+    assert report().to_values() == []
+
+
+def test_async_iter_items():
+    httpx = pytest.importorskip("httpx")
+    pages = [
+        {"result": {"Clients": [{"id": 1}], "LimitedBy": 1}},
+        {"result": {"Clients": [{"id": 2}]}},
+        {"result": {"Clients": [{"id": 1}], "LimitedBy": 1}},
+    ]
+    request_pages = []
+
+    def handler(request):
+        request_pages.append(orjson.loads(request.content)["params"].get("Page"))
+        return httpx.Response(200, json=pages[len(request_pages) - 1])
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with AsyncYandexDirect(access_token="", session=session) as client:
+            items = client.clients().iter_items(
+                data={"method": "get", "params": {"FieldNames": ["ClientId"]}}
+            )
+            items = [item["id"] async for item in items]
+
+            response = await client.clients().post(
+                data={"method": "get", "params": {"FieldNames": ["ClientId"]}}
+            )
+            # The next pages are not requested by blocking calls.
+            with pytest.raises(TypeError):
+                list(response().iter_items())
+            with pytest.raises(TypeError):
+                list(response().prefetch_pages())
+            return items
+
+    assert asyncio.run(main()) == [1, 2]
+    assert request_pages == [None, {"Offset": 1}, None]
+
+
+def test_async_get_report():
+    httpx = pytest.importorskip("httpx")
+    bodies = [(202, b""), (201, b""), (200, b"col1\tcol2\nvalue1\tvalue2\n")]
+
+    def handler(request):
+        status_code, content = bodies.pop(0)
+        return httpx.Response(status_code, content=content, headers={"retryIn": "0"})
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = AsyncYandexDirect(access_token="", session=session)
+        return await client.reports().post(data={"params": {}})
+
+    report = asyncio.run(main())
+    assert report.columns == ["col1", "col2"]
+    assert report().to_dicts() == [{"col1": "value1", "col2": "value2"}]
+
+
+def test_fetch_reports():
+    httpx = pytest.importorskip("httpx")
+    pending = {}
+    max_pending = {}
+
+    def handler(request):
+        login = request.headers["Client-Login"]
+        name = orjson.loads(request.content)["params"]["ReportName"]
+        if name not in pending.setdefault(login, set()):
+            pending[login].add(name)
+            max_pending[login] = max(max_pending.get(login, 0), len(pending[login]))
+            return httpx.Response(201, headers={"retryIn": "0"})
+
+        pending[login].remove(name)
+        return httpx.Response(200, content="Name\n{}\n".format(name).encode())
+
+    jobs = [
+        (login, {"params": {"ReportName": "{}-{}".format(login, i)}})
+        for login in ("login1", "login2")
+        for i in range(5)
+    ]
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = AsyncYandexDirect(access_token="", session=session)
+        return await fetch_reports(client, jobs, max_reports_per_login=2)
+
+    reports = asyncio.run(main())
+    assert [report().to_lines() for report in reports] == [
+        [body["params"]["ReportName"]] for _, body in jobs
+    ]
+    assert max_pending == {"login1": 2, "login2": 2}
+
+
+def test_units_limiter():
+    limiter = UnitsLimiter(reserve=10)
+    assert limiter.acquire("login") == 0
+
+    # Restoring 1 unit per second.
+    limiter.update("login", "20/30/86400")
+    assert limiter.acquire("login") == 0
+    assert limiter.remaining("login") == pytest.approx(10, abs=1)
+    assert limiter.get_delay("login") == pytest.approx(20, abs=1)
+    assert limiter.acquire("login") == pytest.approx(20, abs=1)
+    assert limiter.acquire("login") == pytest.approx(40, abs=1)
+    # Reports do not reserve units.
+    assert limiter.acquire("login", units=False) == 0
+    assert limiter.remaining("login") == pytest.approx(-30, abs=1)
+    assert limiter.get_delay("other login") == 0
+
+
+class FakeRedis:
+    """Commands of Redis used by RedisLimiterBackend."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        value = self.data.get(name)
+        if value is not None and value[1] is not None and value[1] < time.time():
+            del self.data[name]
+            return None
+        return None if value is None else value[0]
+
+    def set(self, name, value, nx=False, px=None):
+        if nx and self.get(name) is not None:
+            return None
+        if isinstance(value, str):
+            value = value.encode()
+        self.data[name] = (value, None if px is None else time.time() + px / 1000)
+        return True
+
+    def eval(self, script, numkeys, *keys_and_args):
+        assert script == RELEASE_LOCK_SCRIPT
+        name, token = keys_and_args
+        if self.get(name) == token.encode():
+            del self.data[name]
+            return 1
+        return 0
+
+
+def test_redis_limiter_lock_of_other_process():
+    client = FakeRedis()
+    backend = RedisLimiterBackend(client, lock_timeout=0.05)
+    lock_key = backend.prefix + "login:lock"
+    with backend.transaction("login") as state:
+        state["remaining"] = 1
+        # The transaction ran longer than the lock timeout,
+        # the expired lock is taken by another process.
+        time.sleep(0.1)
+        client.set(lock_key, "other token", nx=True)
+    assert client.get(lock_key) == b"other token"
+    del client.data[lock_key]
+    with backend.transaction("login") as state:
+        assert state == {"remaining": 1}
+    assert client.get(lock_key) is None
+
+
+@pytest.mark.parametrize(
+    "backend_factory",
+    [
+        lambda tmp_path: SqliteLimiterBackend(tmp_path / "limiter.db"),
+        lambda tmp_path: RedisLimiterBackend(FakeRedis()),
+    ],
+)
+def test_shared_units_limiter(tmp_path, backend_factory):
+    backend = backend_factory(tmp_path)
+    # The limiters of different processes with the same storage.
+    if isinstance(backend, SqliteLimiterBackend):
+        other_backend = SqliteLimiterBackend(tmp_path / "limiter.db")
+    else:
+        other_backend = RedisLimiterBackend(backend.client)
+    limiter = UnitsLimiter(backend=backend, max_concurrent_requests=2)
+    other_limiter = UnitsLimiter(backend=other_backend, max_concurrent_requests=2)
+
+    limiter.update("login", "20/30/86400")
+    assert other_limiter.remaining("login") == pytest.approx(30, abs=1)
+
+    assert limiter.acquire("login") == 0
+    assert other_limiter.acquire("login") == pytest.approx(10, abs=1)
+    # Both slots of concurrent requests are busy.
+    assert limiter.acquire("login") is None
+    other_limiter.release("login")
+    assert limiter.acquire("login") == pytest.approx(30, abs=1)
+    assert limiter.acquire("other login") == 0
+
+
+@responses.activate
+def test_units_limiter_updated_by_response():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": []}},
+        headers={"Units": "10/20828/64000"},
+        status=200,
+    )
+    limiter = UnitsLimiter()
+    limited_client = YandexDirect(access_token="", login="login", units_limiter=limiter)
+    limited_client.clients().post(data={"method": "get", "params": {}})
+
+    assert limiter.remaining("login") == pytest.approx(20828, abs=1)
+
+
+@responses.activate
+def test_units_limiter_slot_of_failed_request():
+    url = "https://api.direct.yandex.com/json/v5/clients"
+    responses.add(responses.POST, url, body=requests.ConnectionError())
+    limiter = UnitsLimiter(max_concurrent_requests=1)
+    limited_client = YandexDirect(access_token="", login="login", units_limiter=limiter)
+    with pytest.raises(requests.ConnectionError):
+        limited_client.clients().post(data={"method": "get", "params": {}})
+    # The slot is released without the response.
+    assert limiter.acquire("login") == 0
+
+
+def test_async_units_limiter_slot_of_failed_request():
+    httpx = pytest.importorskip("httpx")
+    limiter = UnitsLimiter(max_concurrent_requests=1)
+
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = AsyncYandexDirect(
+            access_token="", login="login", units_limiter=limiter, session=session
+        )
+        with pytest.raises(httpx.ConnectError):
+            await client.clients().post(data={"method": "get", "params": {}})
+
+    asyncio.run(main())
+    assert limiter.acquire("login") == 0
+
+
+@responses.activate
+def test_prefetch_pages():
+    ids = list(range(7))
+    offsets = []
+
+    def callback(request):
+        page = orjson.loads(request.body)["params"].get("Page", {})
+        offset, limit = page.get("Offset", 0), page.get("Limit", 2)
+        offsets.append(offset)
+        result = {"Clients": [{"id": i} for i in ids[offset : offset + limit]]}
+        if offset + limit < len(ids):
+            result["LimitedBy"] = offset + limit
+        return 200, {}, orjson.dumps({"result": result})
+
+    responses.add_callback(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        callback=callback,
+    )
+    clients = client.clients().post(
+        data={"method": "get", "params": {"FieldNames": ["ClientId"]}}
+    )
+    pages = list(clients().prefetch_pages(workers=3))
+
+    assert [[item["id"] for item in page().items()] for page in pages] == [
+        [0, 1],
+        [2, 3],
+        [4, 5],
+        [6],
+    ]
+    assert sorted(offsets)[:4] == [0, 2, 4, 6]
+    # Speculative requests after the last page.
+    assert len(offsets) <= 4 + 3 - 1
+
+
+@responses.activate
+def test_post_batches():
+    def callback(request):
+        bids = orjson.loads(request.body)["params"]["KeywordBids"]
+        assert len(bids) <= 2
+        results = [{"KeywordId": bid["KeywordId"]} for bid in bids]
+        return 200, {}, orjson.dumps({"result": {"SetResults": results}})
+
+    responses.add_callback(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/keywordbids",
+        callback=callback,
+    )
+    body = {
+        "method": "set",
+        "params": {
+            "KeywordBids": [{"KeywordId": i, "SearchBid": 1000000} for i in range(5)]
+        },
+    }
+    results = post_batches(client.keywordbids(), data=body, workers=3, limit=2)
+
+    assert [result["KeywordId"] for result in results] == [0, 1, 2, 3, 4]
+    assert len(responses.calls) == 3
+    assert len(body["params"]["KeywordBids"]) == 5
+
+
+@responses.activate
+def test_post_batches_retries(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(
+        "tapi_yandex_direct.tapi_yandex_direct.time.sleep", sleeps.append
+    )
+    # The first two attempts of all batches fail together.
+    barrier = threading.Barrier(3, timeout=5)
+    attempts = collections.Counter()
+
+    def callback(request):
+        bids = orjson.loads(request.body)["params"]["KeywordBids"]
+        batch = bids[0]["KeywordId"]
+        attempts[batch] += 1
+        if attempts[batch] <= 2:
+            barrier.wait()
+            error = {"error_code": 52, "error_string": "Server error"}
+            return 200, {}, orjson.dumps({"error": error})
+        results = [{"KeywordId": bid["KeywordId"]} for bid in bids]
+        return 200, {}, orjson.dumps({"result": {"SetResults": results}})
+
+    responses.add_callback(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/keywordbids",
+        callback=callback,
+    )
+    body = {
+        "method": "set",
+        "params": {
+            "KeywordBids": [{"KeywordId": i, "SearchBid": 1000000} for i in range(6)]
+        },
+    }
+    policy_client = YandexDirect(
+        access_token="", retry_policy=RetryPolicy(base_delay=2, jitter=False)
+    )
+    results = post_batches(policy_client.keywordbids(), data=body, workers=3, limit=2)
+
+    assert [result["KeywordId"] for result in results] == [0, 1, 2, 3, 4, 5]
+    # Each batch counts its own retries.
+    assert sorted(sleeps) == [2, 2, 2, 4, 4, 4]
+
+
+def test_split_request_ids():
+    body = {
+        "method": "get",
+        "params": {"SelectionCriteria": {"Ids": [1, 2, 3]}, "FieldNames": ["Id"]},
+    }
+    assert split_request(body, 2) == [
+        {
+            "method": "get",
+            "params": {"SelectionCriteria": {"Ids": [1, 2]}, "FieldNames": ["Id"]},
+        },
+        {
+            "method": "get",
+            "params": {"SelectionCriteria": {"Ids": [3]}, "FieldNames": ["Id"]},
+        },
+    ]
+    assert body["params"]["SelectionCriteria"]["Ids"] == [1, 2, 3]
+
+    body = {"method": "get", "params": {"SelectionCriteria": {"CampaignIds": [1, 2]}}}
+    assert len(split_request(body, 1)) == 2
+    assert get_batch_limit("campaigns", "get", "Ids") == 1000
+    assert get_batch_limit("adgroups", "get", "Ids") == 10000
+    assert get_batch_limit("adgroups", "get", "CampaignIds") == 10
+
+
+def test_split_request_criteria():
+    body = {
+        "method": "get",
+        "params": {"SelectionCriteria": {"Ids": [1, 2, 3], "CampaignIds": [7, 8]}},
+    }
+    bodies = split_request(body, 1, {"Ids": 2})
+    assert [body["params"]["SelectionCriteria"] for body in bodies] == [
+        {"Ids": [1, 2], "CampaignIds": [7]},
+        {"Ids": [1, 2], "CampaignIds": [8]},
+        {"Ids": [3], "CampaignIds": [7]},
+        {"Ids": [3], "CampaignIds": [8]},
+    ]
+
+
+ARROW_REPORT = (
+    "Date\tCampaignName\tClicks\tCost\tCtr\n"
+    '2021-05-01\t"Name\t10\t1500000\t1.5\n'
+    "2021-05-02\tName\t--\t0\t--\n"
+)
+
+
+@responses.activate
+def test_report_to_arrow():
+    pytest.importorskip("pyarrow")
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body=ARROW_REPORT,
+        status=200,
+    )
+    report = client.reports().post(data={"params": {}})
+
+    table = report().to_arrow()
+    assert [str(field.type) for field in table.schema] == [
+        "date32[day]",
+        "string",
+        "int64",
+        "int64",
+        "double",
+    ]
+    assert table.column("Clicks").to_pylist() == [10, None]
+    assert table.column("CampaignName").to_pylist() == ['"Name', "Name"]
+
+
+@responses.activate
+def test_report_to_pandas():
+    pytest.importorskip("pyarrow")
+    pytest.importorskip("pandas")
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body=ARROW_REPORT,
+        status=200,
+    )
+    report = client.reports().post(data={"params": {}})
+
+    assert report().to_numpy()["Cost"].tolist() == [1500000, 0]
+    assert report().to_pandas()["Ctr"].tolist()[0] == 1.5
+
+
+@responses.activate
+def test_report_cache(tmp_path):
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="col1\tcol2\nvalue1\tvalue2\n",
+        status=200,
+    )
+    body = {
+        "params": {
+            "SelectionCriteria": {"DateFrom": "2021-05-01", "DateTo": "2021-05-02"},
+            "FieldNames": ["Date", "CampaignId"],
+            "ReportName": "report name",
+            "ReportType": "CAMPAIGN_PERFORMANCE_REPORT",
+            "DateRangeType": "CUSTOM_DATE",
+            "Format": "TSV",
+        }
+    }
+    cached_client = YandexDirect(
+        access_token="", report_cache=ReportCache(tmp_path, ttl=60)
+    )
+    report = cached_client.reports().post(data=body)
+    report_name = orjson.loads(responses.calls[0].request.body)["params"]["ReportName"]
+    assert report_name == create_report_name(body, report.request_kwargs["headers"])
+    assert report().to_values() == [["value1", "value2"]]
+
+    for stream_report in (False, True):
+        cached_client = YandexDirect(
+            access_token="",
+            report_cache=ReportCache(tmp_path),
+            stream_report=stream_report,
+        )
+        report = cached_client.reports().post(data=body)
+        assert report().to_values() == [["value1", "value2"]]
+
+    assert len(responses.calls) == 1
+
+
+def test_report_cache_put_in_threads(tmp_path):
+    report_cache = ReportCache(tmp_path)
+    # Both threads are writing the report at the same time.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def chunks(value):
+        yield value
+        barrier.wait()
+        yield value
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [
+            pool.submit(report_cache.put, "report", chunks(value))
+            for value in (b"1", b"2")
+        ]
+        filepaths = {future.result() for future in futures}
+
+    assert [filepath.read_bytes() for filepath in filepaths] in ([b"11"], [b"22"])
+    assert [filepath.name for filepath in tmp_path.iterdir()] == ["report.tsv"]
+
+
+def test_create_report_name():
+    body = {"params": {"DateRangeType": "CUSTOM_DATE", "ReportName": "1"}}
+    name = create_report_name(body, {"Client-Login": "login"})
+
+    assert name == create_report_name(
+        {"params": {"ReportName": "2", "DateRangeType": "CUSTOM_DATE"}},
+        {"client-login": "login", "Authorization": "token"},
+    )
+    assert name != create_report_name(body, {"Client-Login": "other login"})
+    assert create_report_name(body, {"Authorization": "Bearer A"}) != (
+        create_report_name(body, {"Authorization": "Bearer B"})
+    )
+
+
+@responses.activate
+@pytest.mark.parametrize(
+    "backend_factory",
+    [
+        lambda tmp_path: MemoryCacheBackend(),
+        lambda tmp_path: SqliteCacheBackend(tmp_path / "cache.db"),
+    ],
+)
+def test_response_cache(tmp_path, backend_factory):
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 1}], "LimitedBy": 1}},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 2}]}},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"UpdateResults": [{"Id": 1}]}},
+        status=200,
+    )
+    cache = ResponseCache(ttl={"clients": 60}, backend=backend_factory(tmp_path))
+    cached_client = YandexDirect(access_token="", response_cache=cache)
+    body = {"method": "get", "params": {"FieldNames": ["ClientId"]}}
+
+    for _ in range(2):
+        clients = cached_client.clients().post(data=body)
+        assert [item["id"] for item in clients().iter_items()] == [1, 2]
+
+    assert len(responses.calls) == 2
+
+    for _ in range(2):
+        cached_client.clients().post(data={"method": "update", "params": {}})
+
+    assert len(responses.calls) == 4
+
+    request = cached_client.clients().post(data=body).response.request
+    keys = set()
+    for token in ("A", "B"):
+        request.headers["Authorization"] = "Bearer {}".format(token)
+        keys.add(cache.get_key(request))
+    assert len(keys) == 2
+
+
+@responses.activate
+def test_response_cache_does_not_take_units():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 1}]}},
+        headers={"Units": "10/1000/64000"},
+        status=200,
+    )
+    limiter = UnitsLimiter(max_concurrent_requests=1)
+    cached_client = YandexDirect(
+        access_token="",
+        login="login",
+        units_limiter=limiter,
+        response_cache=ResponseCache(ttl={"clients": 60}),
+    )
+    body = {"method": "get", "params": {"FieldNames": ["ClientId"]}}
+    for _ in range(3):
+        cached_client.clients().post(data=body)
+
+    assert len(responses.calls) == 1
+    assert limiter.remaining("login") == pytest.approx(1000, abs=1)
+    assert limiter.acquire("login") == 0
+
+
+@responses.activate
+def test_shared_session():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 1}]}},
+        status=200,
+    )
+    session = create_session(pool_maxsize=50)
+    adapters = dict(session.adapters)
+    cache = ResponseCache(ttl={"clients": 60})
+    other_cache = ResponseCache(ttl={"clients": 60})
+    cached_client = YandexDirect(
+        access_token="", login="login", session=session, response_cache=cache
+    )
+    other_cached_client = YandexDirect(
+        access_token="", login="login", session=session, response_cache=other_cache
+    )
+    plain_client = YandexDirect(access_token="", login="login", session=session)
+
+    # The sessions of the clients use the adapters and the pools of the passed session.
+    assert cached_client._session.adapters is plain_client._session.adapters
+    assert plain_client._session.adapters is session.adapters
+    url = "https://api.direct.yandex.com/json/v5/clients"
+    assert session.get_adapter(url)._pool_maxsize == 50
+
+    # The caches are not mounted to the session, each serves only its client.
+    body = {"method": "get", "params": {"FieldNames": ["ClientId"]}}
+    for _ in range(2):
+        cached_client.clients().post(data=body)
+        plain_client.clients().post(data=body)
+    assert len(responses.calls) == 3
+    other_cached_client.clients().post(data=body)
+    assert len(responses.calls) == 4
+    assert dict(session.adapters) == adapters
+
+    pooled_client = YandexDirect(access_token="", pool_maxsize=20)
+    adapter = pooled_client._session.get_adapter("https://api.direct.yandex.com/")
+    assert adapter._pool_maxsize == 20
+
+
+@responses.activate
+def test_request_body_is_not_parsed_again():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 1}], "LimitedBy": 1}},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/clients",
+        json={"result": {"Clients": [{"id": 2}]}},
+        status=200,
+    )
+    body = {"method": "get", "params": {"FieldNames": ["ClientId"]}}
+    clients = client.clients().post(data=body)
+
+    assert [item["id"] for item in clients().iter_items()] == [1, 2]
+    assert body == {"method": "get", "params": {"FieldNames": ["ClientId"]}}
+
+    adapter = YandexDirectClientAdapter()
+    request_kwargs = adapter.get_request_kwargs(
+        {}, "POST", url="https://api.direct.yandex.com/json/v5/clients", data=body
+    )
+    assert adapter._get_request_body(request_kwargs) == body
+    assert adapter._get_request_body(dict(request_kwargs)) == body
+
+
+@responses.activate
+@pytest.mark.parametrize("stream_report", [False, True])
+def test_report_selected_columns(stream_report):
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="Date\tCampaignName\tCost\n2021-05-01\tКампания\t10\n2021-05-02\tName\t20\n",
+        status=200,
+    )
+    report_client = YandexDirect(access_token="", stream_report=stream_report)
+    report = report_client.reports().post(data={"params": {}})
+
+    if stream_report:
+        assert report().to_dicts(columns=["CampaignName", "Cost"]) == [
+            {"CampaignName": "Кампания", "Cost": "10"},
+            {"CampaignName": "Name", "Cost": "20"},
+        ]
+    else:
+        assert report().to_values(columns=["Cost", "Date"]) == [
+            ["10", "2021-05-01"],
+            ["20", "2021-05-02"],
+        ]
+        assert report().to_columns(columns=["CampaignName"]) == [["Кампания", "Name"]]
+        assert report().to_dicts(columns=["Cost"]) == [{"Cost": "10"}, {"Cost": "20"}]
+        with pytest.raises(KeyError):
+            report().to_values(columns=["Clicks"])
+
+
+@responses.activate
+@pytest.mark.parametrize("stream_report", [False, True])
+def test_report_aggregate(stream_report):
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body=(
+            "Date\tCampaignId\tClicks\tCost\n"
+            "2021-05-01\t1\t2\t10.5\n"
+            "2021-05-01\t2\t--\t--\n"
+            "2021-05-02\t1\t3\t1.5\n"
+        ),
+        status=200,
+    )
+    report_client = YandexDirect(access_token="", stream_report=stream_report)
+    report = report_client.reports().post(data={"params": {}})
+
+    assert report().aggregate(by=["CampaignId"], sum=["Clicks", "Cost"]) == [
+        {"CampaignId": "1", "Clicks": 5, "Cost": 12.0},
+        {"CampaignId": "2", "Clicks": 0, "Cost": 0},
+    ]
+    if not stream_report:
+        assert report().aggregate(by=[], sum=["Clicks"]) == [{"Clicks": 5}]
+        with pytest.raises(ValueError):
+            report().aggregate(by=["CampaignId"], sum=["Date"])
+        with pytest.raises(KeyError):
+            report().aggregate(by=["AdId"], sum=["Clicks"])
+
+
+@responses.activate
+def test_report_records():
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="Date\tCost\n2021-05-01\t10\n2021-05-02\t20\n",
+        status=200,
+    )
+    report = client.reports().post(data={"params": {}})
+    records = report().to_records()
+
+    assert records == [("2021-05-01", "10"), ("2021-05-02", "20")]
+    assert records[0].Cost == records[0]["Cost"] == records[0][1] == "10"
+    assert records[0].get("Clicks") is None
+    assert dict(records[0]) == {"Date": "2021-05-01", "Cost": "10"}
+    assert records[0].to_dict() == {"Date": "2021-05-01", "Cost": "10"}
+    assert type(records[0]) is type(records[1])
+    assert not hasattr(records[0], "__dict__")
+    assert [record.Cost for record in report().iter_records(columns=["Cost"])] == [
+        "10",
+        "20",
+    ]
+
+
+@responses.activate
+@pytest.mark.parametrize("stream_report", [False, True])
+def test_report_save(tmp_path, monkeypatch, stream_report):
+    # The lines and the characters are split between the chunks of the stream.
+    monkeypatch.setattr(ReportStream.__init__, "__defaults__", (5,))
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="Date\tCampaignName\tClicks\n2021-05-01\tКампания\t10\n2021-05-02\tName\t--\n",
+        status=200,
+    )
+    report_client = YandexDirect(access_token="", stream_report=stream_report)
+    extra_columns = {"login": "my-login"}
+
+    def save(format):
+        report = report_client.reports().post(data={"params": {}})
+        filepath = tmp_path / "report.{}".format(format)
+        return report().save(path=filepath, format=format, extra_columns=extra_columns)
+
+    assert save("tsv").read_text() == (
+        "Date\tCampaignName\tClicks\tlogin\n"
+        "2021-05-01\tКампания\t10\tmy-login\n"
+        "2021-05-02\tName\t--\tmy-login\n"
+    )
+    extra_columns = {}
+    assert save("tsv").read_text() == (
+        "Date\tCampaignName\tClicks\n"
+        "2021-05-01\tКампания\t10\n"
+        "2021-05-02\tName\t--\n"
+    )
+    extra_columns = {"login": "my-login"}
+    assert save("csv").read_text().splitlines()[1] == "2021-05-01,Кампания,10,my-login"
+    assert orjson.loads(save("jsonl").read_bytes().splitlines()[1]) == {
+        "Date": "2021-05-02",
+        "CampaignName": "Name",
+        "Clicks": "--",
+        "login": "my-login",
+    }
+
+    with pytest.raises(ValueError):
+        save("xlsx")
+
+
+@responses.activate
+@pytest.mark.parametrize("stream_report", [False, True])
+def test_report_save_parquet(tmp_path, stream_report):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    responses.add(
+        responses.POST,
+        "https://api.direct.yandex.com/json/v5/reports",
+        body="Date\tCampaignName\tClicks\n2021-05-01\tКампания\t10\n2021-05-02\tName\t--\n",
+        status=200,
+    )
+    report_client = YandexDirect(access_token="", stream_report=stream_report)
+    report = report_client.reports().post(data={"params": {}})
+    filepath = report().save(
+        path=tmp_path / "report.parquet",
+        format="parquet",
+        extra_columns={"login": "my-login"},
+    )
+
+    table = parquet.read_table(filepath)
+    assert table.column_names == ["Date", "CampaignName", "Clicks", "login"]
+    assert table.column("Clicks").to_pylist() == [10, None]
+    assert table.column("login").to_pylist() == ["my-login", "my-login"]
+
+
+@responses.activate
+def test_report_stream_chunks():
+    url = "https://api.direct.yandex.com/json/v5/reports"
+    responses.add(responses.POST, url, body="col1\tcol2\n1\t2\n3\t4\n")
+    stream = ReportStream(requests.post(url, stream=True), chunk_size=4)
+    assert stream.columns == "col1\tcol2"
+    assert b"".join(stream.iter_chunks()) == b"1\t2\n3\t4\n"
+
+    stream = ReportStream(requests.post(url, stream=True))
+    assert list(stream) == ["col1\tcol2", "1\t2", "3\t4"]
+    with pytest.raises(ValueError):
+        stream.iter_chunks()
+
+
+@responses.activate
+def test_incremental_sync(tmp_path):
+    url = "https://api.direct.yandex.com/json/v5/"
+    changes = {
+        "checkDictionaries": {"Timestamp": "2021-05-01T00:00:00Z"},
+        "checkCampaigns": {
+            "Timestamp": "2021-05-02T00:00:00Z",
+            "Campaigns": [
+                {"CampaignId": 1, "ChangesIn": ["CHILDREN"]},
+                {"CampaignId": 2, "ChangesIn": ["SELF", "CHILDREN"]},
+            ],
+        },
+        "check": {
+            "Modified": {"AdGroupIds": [10], "AdIds": [100, 101]},
+            "NotFound": {"CampaignIds": [2]},
+        },
+    }
+    objects = {
+        "campaigns": [{"Id": 1, "Name": "A"}, {"Id": 2, "Name": "B"}],
+        "adgroups": [{"Id": 10, "CampaignId": 1}, {"Id": 20, "CampaignId": 2}],
+        "ads": [{"Id": 100, "CampaignId": 1}, {"Id": 101, "CampaignId": 1}],
+    }
+
+    def changes_callback(request):
+        body = orjson.loads(request.body)
+        return 200, {}, orjson.dumps({"result": changes[body["method"]]})
+
+    def get_callback(request):
+        entity = request.path_url.rsplit("/", 1)[-1]
+        items = objects[entity]
+        criteria = orjson.loads(request.body)["params"]["SelectionCriteria"]
+        if "Ids" in criteria:
+            items = [item for item in items if item["Id"] in criteria["Ids"]]
+        key = {"campaigns": "Campaigns", "adgroups": "AdGroups", "ads": "Ads"}[entity]
+        return 200, {}, orjson.dumps({"result": {key: items}})
+
+    responses.add_callback(responses.POST, url + "changes", callback=changes_callback)
+    for entity in ("campaigns", "adgroups", "ads"):
+        responses.add_callback(responses.POST, url + entity, callback=get_callback)
+
+    snapshot = SqliteSnapshot(tmp_path / "snapshot.db")
+    sync = IncrementalSync(snapshot, workers=2)
+    login_client = YandexDirect(access_token="", login="login")
+
+    assert sync.sync(login_client) == {"campaigns": 2, "adgroups": 2, "ads": 2}
+    assert snapshot.get_timestamp("login") == "2021-05-01T00:00:00Z"
+
+    objects["adgroups"][0]["Name"] = "New"
+    del objects["ads"][1]
+    del objects["campaigns"][1]
+    calls_count = len(responses.calls)
+    assert sync.sync(login_client) == {
+        "campaigns": 0,
+        "adgroups": 1,
+        "ads": 1,
+        "deleted": 3,
+    }
+    # checkCampaigns, check and get of the modified campaigns, ad groups and ads.
+    assert len(responses.calls) - calls_count == 5
+    assert snapshot.get_timestamp("login") == "2021-05-02T00:00:00Z"
+    assert snapshot.get("login", "campaigns") == [{"Id": 1, "Name": "A"}]
+    assert snapshot.get("login", "adgroups") == [
+        {"Id": 10, "CampaignId": 1, "Name": "New"}
+    ]
+    assert snapshot.get("login", "ads") == [{"Id": 100, "CampaignId": 1}]
+
+
+@responses.activate
+def test_fetch_report_by_date_ranges():
+    def callback(request):
+        criteria = orjson.loads(request.body)["params"]["SelectionCriteria"]
+        if criteria["DateFrom"] < "2021-01-04" and criteria["DateTo"] > "2021-01-04":
+            return 502, {}, "Report generation time has exceeded the server limit"
+        return 200, {}, "Date\tClicks\n{}\t1\n".format(criteria["DateFrom"])
+
+    responses.add_callback(
+        responses.POST, "https://api.direct.yandex.com/json/v5/reports", callback
+    )
+    body = {
+        "params": {
+            "SelectionCriteria": {"DateFrom": "2021-01-01", "DateTo": "2021-01-09"},
+            "DateRangeType": "CUSTOM_DATE",
+            "ReportName": "report",
+        }
+    }
+
+    lines = fetch_report_by_date_ranges(client, body, workers=2)
+    assert list(lines) == [
+        "Date\tClicks",
+        "2021-01-01\t1",
+        "2021-01-04\t1",
+        "2021-01-06\t1",
+    ]
+    names = {
+        orjson.loads(call.request.body)["params"]["ReportName"]
+        for call in responses.calls
+    }
+    assert "report 2021-01-04_2021-01-05" in names
+
+    with pytest.raises(YandexDirectApiError):
+        fetch_report_by_date_ranges(client, body, days=5, min_days=5)
+    assert list(iter_merged_lines([])) == []
+
+
+@responses.activate
+def test_report_scheduler():
+    polls = {}
+
+    def callback(request):
+        name = orjson.loads(request.body)["params"]["ReportName"]
+        polls[name] = polls.get(name, 0) + 1
+        if polls[name] < 3:
+            return 201, {"retryIn": "0"}, ""
+        return 200, {}, "Name\n{}\n".format(name)
+
+    responses.add_callback(
+        responses.POST, "https://api.direct.yandex.com/json/v5/reports", callback
+    )
+
+    with ReportScheduler(workers=2) as scheduler:
+        futures = [
+            scheduler.submit(client, {"params": {"ReportName": name}})
+            for name in ("report1", "report2")
+        ]
+
+    assert [future.result()().to_values() for future in futures] == [
+        [["report1"]],
+        [["report2"]],
+    ]
+    assert polls == {"report1": 3, "report2": 3}
+    with pytest.raises(RuntimeError):
+        scheduler.submit(client, {"params": {}})
+
+
+def test_retry_policy():
+    policy = RetryPolicy(
+        base_delay=1,
+        max_delay=5,
+        max_retries=4,
+        max_elapsed_time=100,
+        overrides={9000: RetryPolicy(base_delay=30, jitter=False)},
+    )
+    for repeat_number, max_delay in ((1, 1), (2, 2), (3, 4), (4, 5)):
+        assert 0 <= policy.get_delay(repeat_number) <= max_delay
+    assert policy.get_delay(5) is None
+    assert policy.get_delay(1, elapsed=99.5, hint=1) is None
+    assert policy.get_delay(1, hint=7) == 7
+    assert policy.get_policy(9000).get_delay(2) == 60
+    assert policy.get_policy(52) is policy
+    assert policy.get_policy(152).get_delay(1) == 300
+    assert RetryPolicy().get_policy(152).get_delay(1) == 300
+    assert RetryPolicy(overrides={152: policy}).get_policy(152) is policy
+
+
+@responses.activate
+def test_retry_policy_of_request(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(
+        "tapi_yandex_direct.tapi_yandex_direct.time.sleep", sleeps.append
+    )
+    error = {
+        "error": {
+            "error_code": 52,
+            "request_id": "1",
+            "error_string": "Server error",
+            "error_detail": "",
+        }
+    }
+    url = "https://api.direct.yandex.com/json/v5/clients"
+    responses.add(responses.POST, url, json=error, headers={"Retry-After": "3"})
+    responses.add(responses.POST, url, json=error)
+    responses.add(responses.POST, url, json={"result": {"Clients": [{"Id": 1}]}})
+
+    policy = RetryPolicy(base_delay=2, jitter=False)
+    result = client.clients().post(
+        data={"method": "get", "params": {}}, retry_policy=policy
+    )
+    assert result().extract() == [{"Id": 1}]
+    assert sleeps == [3, 4]
+
+    responses.add(responses.POST, url, json=error)
+    policy_client = YandexDirect(
+        access_token="", retry_policy=RetryPolicy(max_retries=1, base_delay=0)
+    )
+    with pytest.raises(YandexDirectApiError):
+        policy_client.clients().post(data={"method": "get", "params": {}})
+
+
+@responses.activate
+def test_retry_after_report_wait(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(
+        "tapi_yandex_direct.tapi_yandex_direct.time.sleep", sleeps.append
+    )
+    error = {
+        "error": {
+            "error_code": 52,
+            "request_id": "1",
+            "error_string": "Server error",
+            "error_detail": "",
+        }
+    }
+    url = "https://api.direct.yandex.com/json/v5/reports"
+    for _ in range(3):
+        responses.add(responses.POST, url, status=201, headers={"retryIn": "1"})
+    responses.add(responses.POST, url, json=error, status=500)
+    responses.add(responses.POST, url, json=error, status=500)
+    responses.add(responses.POST, url, body="col1\tcol2\nvalue1\tvalue2\n")
+
+    policy = RetryPolicy(base_delay=2, jitter=False)
+    report = client.reports().post(data={"params": {}}, retry_policy=policy)
+    assert report().to_values() == [["value1", "value2"]]
+    # The waits of the report do not count towards the backoff of the errors.
+    assert sleeps == [1, 1, 1, 2, 4]
+
+
+def test_api_emulator(monkeypatch):
+    monkeypatch.setattr(
+        "tapi_yandex_direct.tapi_yandex_direct.time.sleep", lambda seconds: None
+    )
+    limiter = UnitsLimiter()
+    with ApiEmulator(objects_count=25, retry_in=0, report_rows=3) as emulator:
+        emulator_client = YandexDirect(
+            access_token="",
+            login="login",
+            api_root=emulator.url,
+            units_limiter=limiter,
+            retry_if_exceeded_limit=True,
+        )
+        body = {
+            "method": "get",
+            "params": {"FieldNames": ["Id", "Name"], "Page": {"Limit": 10}},
+        }
+        emulator.inject_error(52)
+        items = list(emulator_client.campaigns().post(data=body)().iter_items())
+        assert len(items) == 25
+        assert items[-1] == {"Id": 25, "Name": "Name 25"}
+        # Error 52 is retried, then 3 pages.
+        assert emulator.requests_count["/json/v5/campaigns"] == 4
+        assert limiter.remaining("login") == pytest.approx(64000 - 30, abs=1)
+
+        report = emulator_client.reports().post(
+            data={"params": {"ReportName": "r", "FieldNames": ["Date", "Clicks"]}}
+        )
+        assert report.columns == ["Date", "Clicks"]
+        assert len(report().to_values()) == 3
+        # 201, then 200.
+        assert emulator.requests_count["/json/v5/reports"] == 2
+
+        emulator.max_reports_in_queue = 0
+        with pytest.raises(YandexDirectRequestsLimitError):
+            YandexDirect(
+                access_token="", api_root=emulator.url, retry_if_exceeded_limit=False
+            ).reports().post(data={"params": {"ReportName": "r"}})
+
+
+def load_export_script():
+    path = Path(__file__).parent.parent / "scripts" / "yandex_direct_export_to_file.py"
+    spec = importlib.util.spec_from_file_location("yandex_direct_export_to_file", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("parts", [False, True])
+def test_export_pages_resume(tmp_path, monkeypatch, parts):
+    export_script = load_export_script()
+    post = export_script.post
+    filepath = tmp_path / "campaigns.tsv"
+
+    def export(extra_columns, crash_on_request=None):
+        requests_count = itertools.count(1)
+
+        def crashing_post(*args, **kwargs):
+            if next(requests_count) == crash_on_request:
+                raise RuntimeError("crash")
+            return post(*args, **kwargs)
+
+        monkeypatch.setattr(export_script, "post", crashing_post)
+        body = {
+            "method": "get",
+            "params": {"FieldNames": ["Id", "Name"], "Page": {"Limit": 10}},
+        }
+        export_script.export_pages(
+            emulator_client,
+            body,
+            {},
+            "campaigns",
+            extra_columns,
+            "login",
+            filepath,
+            parts=parts,
+        )
+
+    with ApiEmulator(objects_count=25) as emulator:
+        emulator_client = YandexDirect(
+            access_token="", login="login", api_root=emulator.url
+        )
+        # The process is stopped before the third page, after two pages.
+        with pytest.raises(RuntimeError):
+            export(["login"], crash_on_request=3)
+        checkpoint_path = export_script.get_checkpoint_path(filepath)
+        assert orjson.loads(checkpoint_path.read_bytes())["offset"] == 20
+
+        # The checkpoint of other extra columns is not resumed.
+        with pytest.raises(ValueError):
+            export([])
+
+        if parts:
+            # Rows written after the last checkpoint are overwritten.
+            export_script.get_part_path(filepath, 2).write_text("partial page")
+        else:
+            with open(filepath, "a") as f:
+                f.write("21\tpartial row")
+        export(["login"])
+        assert not checkpoint_path.exists()
+
+        if not parts:
+            # The export is started over without the output file.
+            with pytest.raises(RuntimeError):
+                export(["login"], crash_on_request=3)
+            filepath.unlink()
+            export(["login"])
+
+    assert not checkpoint_path.exists()
+    if parts:
+        files = [export_script.get_part_path(filepath, i) for i in range(3)]
+        assert [len(f.read_text().splitlines()) for f in files] == [11, 11, 6]
+        lines = [f.read_text().splitlines() for f in files]
+        assert {part[0] for part in lines} == {"Id\tName\tlogin"}
+        rows = [line for part in lines for line in part[1:]]
+    else:
+        lines = filepath.read_text().splitlines()
+        assert lines[0] == "Id\tName\tlogin"
+        rows = lines[1:]
+    assert rows == ["{0}\tName {0}\tlogin".format(i) for i in range(1, 26)]
+
+
+@responses.activate
+def test_export_pages_columns(tmp_path):
+    export_script = load_export_script()
+    url = "https://api.direct.yandex.com/json/v5/campaigns"
+    pages = [
+        {"Campaigns": [{"Id": 1}], "LimitedBy": 1},
+        {"Campaigns": [{"Id": 2, "Name": "Name 2", "Status": "ON"}]},
+    ]
+    for page in pages:
+        responses.add(responses.POST, url, json={"result": page})
+    filepath = tmp_path / "campaigns.tsv"
+    body = {"method": "get", "params": {"FieldNames": ["Id", "Name"]}}
+    export_script.export_pages(
+        client, body, {}, "campaigns", ["login"], "login", filepath
+    )
+
+    # The columns are taken from FieldNames, the fields of the next pages
+    # that are not in the columns are skipped.
+    assert filepath.read_text().splitlines() == [
+        "Id\tName\tlogin",
+        "1\t\tlogin",
+        "2\tName 2\tlogin",
+    ]
+
+
+def test_export_report_name():
+    export_script = load_export_script()
+    names = set()
+    for headers in (
+        export_script.get_headers(False, False),
+        export_script.get_headers(False, True),
+        export_script.get_headers(True, False),
+    ):
+        body = {"params": {"DateRangeType": "CUSTOM_DATE"}}
+        export_script.prepare_body(body, headers)
+        names.add(body["params"]["ReportName"])
+
+    # The money in micros changes the report, the operator units do not.
+    assert len(names) == 2
+
+
+@responses.activate
+def test_metrics(monkeypatch):
+    monkeypatch.setattr(
+        "tapi_yandex_direct.tapi_yandex_direct.time.sleep", lambda seconds: None
+    )
+    records = []
+    metrics_client = YandexDirect(
+        access_token="",
+        login="login",
+        metrics=CallbackMetrics(lambda *args: records.append(args)),
+    )
+    error = {
+        "error": {
+            "error_code": 52,
+            "request_id": "1",
+            "error_string": "Server error",
+            "error_detail": "",
+        }
+    }
+    url = "https://api.direct.yandex.com/json/v5/clients"
+    responses.add(responses.POST, url, json=error)
+    responses.add(
+        responses.POST,
+        url,
+        json={"result": {"Clients": [{"Id": 1}, {"Id": 2}]}},
+        headers={"Units": "10/990/1000"},
+    )
+    metrics_client.clients().post(data={"method": "get", "params": {}})
+
+    labels = {"login": "login", "resource": "clients"}
+    names = [name for name, value, labels_ in records]
+    assert names.count("request_seconds") == 2
+    assert ("retries", 1, dict(labels, code="52")) in records
+    assert ("units_spent", 10, labels) in records
+    assert ("units_remaining", 990, labels) in records
+    assert ("rows", 2, labels) in records
+
+
+def test_prometheus_metrics():
+    prometheus_client = pytest.importorskip("prometheus_client")
+    labels = {"login": "login", "resource": "clients"}
+    registry = prometheus_client.CollectorRegistry()
+    metrics = PrometheusMetrics(registry=registry)
+    metrics.record("units_spent", 10, labels)
+    metrics.record("errors", 1, dict(labels, code="152"))
+    assert registry.get_sample_value("yandex_direct_units_spent_total", labels) == 10
+    assert (
+        registry.get_sample_value(
+            "yandex_direct_errors_total", dict(labels, code="152")
+        )
+        == 1
+    )
+
+
+@responses.activate
+def test_tracing(tmp_path):
+    url = "https://api.direct.yandex.com/json/v5/reports"
+    responses.add(responses.POST, url, headers={"retryIn": "0"}, status=201)
+    responses.add(
+        responses.POST,
+        url,
+        body="col1\tcol2\nvalue1\tvalue2\n",
+        headers={"RequestId": "123"},
+    )
+    body = {"params": {"ReportName": "report name"}}
+
+    with JsonFileTracer(tmp_path / "trace.json") as tracer:
+        tracing_client = YandexDirect(access_token="", login="login", tracer=tracer)
+        report = tracing_client.reports().post(data=body)
+        assert report().to_values() == [["value1", "value2"]]
+
+    events = orjson.loads((tmp_path / "trace.json").read_bytes())["traceEvents"]
+    spans = {event["name"]: event for event in events}
+    root = spans["yandex_direct.reports"]["args"]
+    assert root["login"] == "login"
+    assert root["report_name"] == "report name"
+    assert root["request_id"] == "123"
+    requests_ = [e for e in events if e["name"] == "yandex_direct.request"]
+    assert [e["args"]["attempt"] for e in requests_] == [1, 2]
+    assert {e["args"]["parent_id"] for e in requests_} == {root["span_id"]}
+    assert spans["yandex_direct.report_wait"]["args"]["parent_id"] == root["span_id"]
+    assert spans["yandex_direct.decode"]["args"]["parent_id"] == root["span_id"]
+    assert spans["yandex_direct.to_values"]["args"]["parent_id"] == root["span_id"]
+    assert spans["yandex_direct.to_values"]["args"]["rows"] == 1
+    assert spans["yandex_direct.to_values"]["args"]["request_id"] == "123"
+
+
+@responses.activate
+def test_opentelemetry_tracing():
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = OpenTelemetryTracer(provider.get_tracer("tests"))
+    url = "https://api.direct.yandex.com/json/v5/reports"
+    body = {"params": {"ReportName": "report name"}}
+    responses.add(responses.POST, url, body="col1\n1\n")
+    result = YandexDirect(access_token="", tracer=tracer).reports().post(data=body)
+    assert result().to_values() == [["1"]]
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    root = spans["yandex_direct.reports"]
+    assert spans["yandex_direct.request"].parent.span_id == root.context.span_id
+    assert spans["yandex_direct.to_values"].parent.span_id == root.context.span_id
+    assert root.attributes["report_name"] == "report name"